@@ -0,0 +1,105 @@
+"""Compares the cost of converting album dates to epochs.
+
+Run from the repository root:
+
+    python -m benchmarks.date_parser [--sizes 10000 100000 1000000]
+"""
+
+import argparse
+import datetime
+import random
+import time
+
+from rofi_mpd.date_parser import LONG_TIME_AGO, get_epoch_from_date, get_epochs_from_dates, parse_date
+
+
+def legacy_get_epoch_from_date(date):
+    # get_epoch_from_date() as it was before memoization,
+    # minus the formats it crashed on
+    if isinstance(date, list):
+        date = date[0]
+
+    if type(date) == int:
+        return date
+
+    if date.isnumeric():
+        year = int(date)
+        if year < 1 or year > 9999:
+            year = 1
+        epoch = datetime.datetime(year, 1, 1)
+    else:
+        split_char = '-' if '-' in date else '.'
+        date_list = date.split(split_char)
+
+        while len(date_list) < 3:
+            date_list.append(1)
+
+        year = int(date_list[0])
+        month = int(date_list[1])
+        day = int(date_list[2])
+        if year < 1 or year > 9999:
+            year = 1
+        if month < 1 or month > 12:
+            month = 1
+        if day < 1 or day > 31:
+            day = 1
+
+        try:
+            epoch = datetime.datetime(year, month, day)
+        except ValueError:
+            return LONG_TIME_AGO
+
+    return int(epoch.replace(tzinfo=datetime.timezone.utc).timestamp())
+
+
+def make_dates(size, seed=0):
+    """Builds `size` date tags in the mix of formats found in real libraries."""
+    rng = random.Random(seed)
+
+    dates = []
+    for _ in range(size):
+        year = rng.randint(1950, 2020)
+        month = rng.randint(1, 12)
+        day = rng.randint(1, 28)
+        dates.append(rng.choice((
+            '%d' % year,
+            '%d' % year,
+            '%d-%02d' % (year, month),
+            '%d-%02d-%02d' % (year, month, day),
+            '%d.%02d.%02d' % (year, month, day),
+        )))
+
+    return dates
+
+
+def measure(func, dates):
+    start = time.perf_counter()
+    result = func(dates)
+    return time.perf_counter() - start, result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000, 1000000])
+    args = parser.parse_args()
+
+    print('%10s %12s %12s %12s %12s' % ('dates', 'legacy', 'cold', 'warm', 'bulk'))
+    for size in args.sizes:
+        dates = make_dates(size)
+        legacy, expected = measure(lambda d: [legacy_get_epoch_from_date(date) for date in d], dates)
+
+        parse_date.cache_clear()
+        cold, result = measure(lambda d: [get_epoch_from_date(date) for date in d], dates)
+        assert result == expected
+
+        warm, _ = measure(lambda d: [get_epoch_from_date(date) for date in d], dates)
+
+        parse_date.cache_clear()
+        bulk, result = measure(get_epochs_from_dates, dates)
+        assert result == expected
+
+        print('%10d %11.3fs %11.3fs %11.3fs %11.3fs' % (size, legacy, cold, warm, bulk))
+
+
+if __name__ == '__main__':
+    main()
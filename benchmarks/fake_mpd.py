@@ -0,0 +1,535 @@
+"""A stand-in MPD server for benchmarks.
+
+Speaks enough of the MPD protocol for rofi-mpd: `list`, `find`, `findadd`, `add`,
+`load`, `play`, `stats`, `status`, the commands used to build and refresh library
+snapshots, and command lists. It serves a fixed set of tracks from memory.
+
+Run from the repository root to serve a synthetic library:
+
+    python -m benchmarks.fake_mpd [--size 10000] [--port 6600]
+"""
+
+import argparse
+import re
+import socketserver
+import threading
+import time
+
+VERSION = '0.23.0'
+
+ACK_ERROR_ARG = 2
+ACK_ERROR_UNKNOWN = 5
+ACK_ERROR_NO_EXIST = 50
+
+# How tags are spelled in responses. Everything else is matched case-insensitively.
+TAG_NAMES = dict(
+    artist='Artist',
+    albumartist='AlbumArtist',
+    album='Album',
+    title='Title',
+    genre='Genre',
+    date='Date',
+    disc='Disc',
+    track='Track',
+)
+
+NUMERIC_TAGS = ('disc', 'track')
+
+DB_UPDATE = 1577836800
+LAST_MODIFIED = '2020-01-01T00:00:00Z'
+
+TOKEN_PATTERN = re.compile(r'"((?:[^"\\]|\\.)*)"|(\S+)')
+ESCAPE_PATTERN = re.compile(r'\\(.)')
+
+
+class CommandFailed(Exception):
+    def __init__(self, code, message):
+        super().__init__(message)
+        self.code = code
+        self.message = message
+
+
+def make_tracks(size):
+    """Builds `size` tracks laid out like a real library: ten two-disc albums per artist,
+    with six tracks on each disc, stored in `Artist/Album/` directories."""
+    tracks = []
+    for i in range(size):
+        artist = i // 120
+        album = i // 12
+        tracks.append({
+            'file': 'Artist %d/Album %d/%d-%02d.flac' % (artist, album, i % 12 // 6 + 1, i % 6 + 1),
+            'artist': 'Artist %d' % artist,
+            'albumartist': 'Artist %d' % artist,
+            'album': 'Album %d' % album,
+            'title': 'Title %d' % i,
+            'genre': 'Genre %d' % (artist % 20),
+            'date': str(1960 + artist % 60),
+            'disc': str(i % 12 // 6 + 1),
+            'track': str(i % 6 + 1),
+        })
+
+    return tracks
+
+
+def make_playlists(tracks, count=10, length=50):
+    return {'Playlist %d' % i: [track['file'] for track in tracks[i * length:(i + 1) * length]]
+            for i in range(count)}
+
+
+def unescape(value):
+    return ESCAPE_PATTERN.sub(r'\1', value)
+
+
+def split_command(line):
+    """Splits a request line into its command and arguments, removing quotes and escapes."""
+    tokens = []
+    for quoted, bare in TOKEN_PATTERN.findall(line):
+        tokens.append(unescape(quoted) if bare == '' else bare)
+
+    if not tokens:
+        raise CommandFailed(ACK_ERROR_UNKNOWN, 'No command given')
+
+    return tokens[0].lower(), tokens[1:]
+
+
+def get_values(tag, track):
+    value = track.get(tag)
+
+    if value is None:
+        return []
+    if isinstance(value, list):
+        return value
+    return [value]
+
+
+class FilterParser(object):
+    """Parses MPD filter expressions into predicates on tracks.
+
+    Supports tag comparisons (`==`, `!=`), `AND`, `modified-since` and `base`.
+    Like MPD, `base` fails if no track is inside the directory."""
+
+    def __init__(self, expression, tracks):
+        self.expression = expression
+        self.tracks = tracks
+        self.pos = 0
+
+    def parse(self):
+        predicate = self.parse_expression()
+        self.skip_space()
+        if self.pos != len(self.expression):
+            raise self.error()
+        return predicate
+
+    def error(self):
+        return CommandFailed(ACK_ERROR_ARG, 'Malformed filter expression: %s' % self.expression)
+
+    def skip_space(self):
+        while self.pos < len(self.expression) and self.expression[self.pos] == ' ':
+            self.pos += 1
+
+    def expect(self, char):
+        self.skip_space()
+        if not self.expression.startswith(char, self.pos):
+            raise self.error()
+        self.pos += len(char)
+
+    def read_word(self):
+        self.skip_space()
+        start = self.pos
+        while self.pos < len(self.expression) and self.expression[self.pos] not in ' ()"':
+            self.pos += 1
+        if start == self.pos:
+            raise self.error()
+        return self.expression[start:self.pos]
+
+    def read_string(self):
+        self.expect('"')
+        value = []
+        while self.pos < len(self.expression):
+            char = self.expression[self.pos]
+            self.pos += 1
+            if char == '\\':
+                value.append(self.expression[self.pos:self.pos + 1])
+                self.pos += 1
+            elif char == '"':
+                return ''.join(value)
+            else:
+                value.append(char)
+        raise self.error()
+
+    def parse_expression(self):
+        self.expect('(')
+        self.skip_space()
+
+        if self.expression.startswith('(', self.pos):
+            predicates = [self.parse_expression()]
+            self.skip_space()
+            while not self.expression.startswith(')', self.pos):
+                if self.read_word() != 'AND':
+                    raise self.error()
+                predicates.append(self.parse_expression())
+                self.skip_space()
+            self.expect(')')
+            return lambda track: all(predicate(track) for predicate in predicates)
+
+        word = self.read_word()
+        if word == 'modified-since':
+            since = self.read_string()
+            if since.isdigit():
+                since = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(int(since)))
+            predicate = lambda track: track.get('last-modified', LAST_MODIFIED) >= since
+        elif word == 'base':
+            base = self.read_string().rstrip('/') + '/'
+            predicate = lambda track: track['file'].startswith(base)
+            if not any(predicate(track) for track in self.tracks):
+                raise CommandFailed(ACK_ERROR_NO_EXIST, 'No such directory')
+        else:
+            tag = word.lower()
+            operator = self.read_word()
+            value = self.read_string()
+            # As in MPD, an empty value matches tracks without the tag
+            if operator == '==':
+                predicate = lambda track: value in (get_values(tag, track) or [''])
+            elif operator == '!=':
+                predicate = lambda track: value not in (get_values(tag, track) or [''])
+            else:
+                raise self.error()
+
+        self.expect(')')
+        return predicate
+
+
+def parse_filter(args, tracks):
+    """Consumes a filter (an expression or legacy tag/value pairs) from the front of args.
+
+    Returns a predicate, or None if there is no filter, along with the remaining args."""
+    if args and args[0].startswith('('):
+        return FilterParser(args[0], tracks).parse(), args[1:]
+
+    pairs = []
+    while len(args) >= 2 and args[0].lower() not in ('group', 'sort', 'window'):
+        pairs.append((args[0].lower(), args[1]))
+        args = args[2:]
+
+    if not pairs:
+        return None, args
+
+    return lambda track: all(value in get_values(tag, track) for tag, value in pairs), args
+
+
+def parse_options(args):
+    """Returns the sort and window options, along with a list of the tags to group by."""
+    options = dict(group=[])
+    while args:
+        if len(args) < 2 or args[0].lower() not in ('group', 'sort', 'window'):
+            raise CommandFailed(ACK_ERROR_ARG, 'Unexpected argument: %s' % args[0])
+        if args[0].lower() == 'group':
+            options['group'].append(args[1].lower())
+        else:
+            options[args[0].lower()] = args[1]
+        args = args[2:]
+    return options
+
+
+def get_sort_key(tag):
+    if tag in NUMERIC_TAGS:
+        def key(track):
+            value = get_values(tag, track)
+            return int(value[0].split('/')[0]) if value and value[0].split('/')[0].isdigit() else 0
+    else:
+        def key(track):
+            value = get_values(tag, track)
+            return value[0] if value else ''
+    return key
+
+
+def format_track(track):
+    lines = ['file: %s' % track['file']]
+    for tag, name in TAG_NAMES.items():
+        for value in get_values(tag, track):
+            lines.append('%s: %s' % (name, value))
+    lines.append('Last-Modified: %s' % track.get('last-modified', LAST_MODIFIED))
+    return '\n'.join(lines) + '\n'
+
+
+def format_tracks(tracks):
+    return ''.join(format_track(track) for track in tracks)
+
+
+class FakeMPDServer(socketserver.ThreadingTCPServer):
+    """Serves `tracks` (dicts of lowercase tag names) over the MPD protocol.
+
+    Queue changes are applied to `queue`, and `queued_at` records when the first one arrived,
+    for timing how long a client takes to get there. `reset()` clears both between runs."""
+
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, tracks, playlists=None, address=('127.0.0.1', 0)):
+        super().__init__(address, FakeMPDHandler)
+        self.tracks = tracks
+        self.files = {track['file']: track for track in tracks}
+        self.playlists = playlists if playlists is not None else make_playlists(tracks)
+
+        self.queue = []
+        self.queued_at = None
+        self.state = 'stop'
+        self.lock = threading.Lock()
+
+        # Responses to read-only commands, keyed on the request line.
+        # The library never changes, so answers can be reused by later runs.
+        self.responses = {}
+
+        # The last sorted result of find, which windows are cut from
+        self.sorted = {}
+
+        self.thread = None
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def start(self):
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def reset(self):
+        with self.lock:
+            self.queue = []
+            self.queued_at = None
+            self.state = 'stop'
+
+    def enqueue(self, files):
+        with self.lock:
+            if self.queued_at is None:
+                self.queued_at = time.time()
+            self.queue.extend(files)
+
+    def find(self, args):
+        predicate, options_args = parse_filter(args, self.tracks)
+        if predicate is None:
+            raise CommandFailed(ACK_ERROR_ARG, 'Filter expected')
+
+        options = parse_options(options_args)
+
+        # Windows of the same sorted result are asked for one after another
+        key = (tuple(args[:len(args) - len(options_args)]), options.get('sort'))
+        tracks = self.sorted.get(key)
+        if tracks is None:
+            tracks = [track for track in self.tracks if predicate(track)]
+
+            if 'sort' in options:
+                tag = options['sort'].lower()
+                tracks.sort(key=get_sort_key(tag.lstrip('-')), reverse=tag.startswith('-'))
+                self.sorted = {key: tracks}
+
+        if 'window' in options:
+            start, _, end = options['window'].partition(':')
+            tracks = tracks[int(start):int(end) if end else None]
+
+        return tracks
+
+    def list(self, args):
+        if not args:
+            raise CommandFailed(ACK_ERROR_ARG, 'Too few arguments for "list"')
+
+        tag = args[0].lower()
+        predicate, args = parse_filter(args[1:], self.tracks)
+        # The last group given is the outermost
+        group_tags = parse_options(args)['group'][::-1]
+
+        tracks = self.tracks if predicate is None else [track for track in self.tracks if predicate(track)]
+
+        groups = {}
+        for track in tracks:
+            keys = [()]
+            for group in group_tags:
+                keys = [key + (value,) for key in keys for value in get_values(group, track) or ['']]
+            for key in keys:
+                groups.setdefault(key, set()).update(get_values(tag, track))
+
+        lines = []
+        for key in sorted(groups):
+            lines.extend('%s: %s' % (TAG_NAMES.get(group, group), value) for group, value in zip(group_tags, key))
+            lines.extend('%s: %s' % (TAG_NAMES.get(tag, tag), value) for value in sorted(groups[key]))
+
+        return ''.join(line + '\n' for line in lines)
+
+    def count(self, args):
+        predicate, args = parse_filter(args, self.tracks)
+        tracks = [track for track in self.tracks if predicate is None or predicate(track)]
+        return 'songs: %d\nplaytime: 0\n' % len(tracks)
+
+    def lsinfo(self, args):
+        directory = args[0].strip('/') if args else ''
+        prefix = directory + '/' if directory else ''
+
+        tracks = []
+        directories = {}
+        for track in self.tracks:
+            if not track['file'].startswith(prefix):
+                continue
+
+            rest = track['file'][len(prefix):]
+            if '/' in rest:
+                directories[prefix + rest.split('/', 1)[0]] = None
+            else:
+                tracks.append(track)
+
+        if directory and not tracks and not directories:
+            raise CommandFailed(ACK_ERROR_NO_EXIST, 'Not found')
+
+        return ''.join('directory: %s\n' % child for child in directories) + format_tracks(tracks)
+
+    def stats(self):
+        return ('artists: %d\nalbums: %d\nsongs: %d\nuptime: 0\nplaytime: 0\n'
+                'db_playtime: 0\ndb_update: %d\n') % (
+            len(set(track.get('artist') for track in self.tracks)),
+            len(set(track.get('album') for track in self.tracks)),
+            len(self.tracks),
+            DB_UPDATE)
+
+    def status(self):
+        with self.lock:
+            return ('volume: 100\nrepeat: 0\nrandom: 0\nsingle: 0\nconsume: 0\nplaylist: 1\n'
+                    'playlistlength: %d\nstate: %s\n') % (len(self.queue), self.state)
+
+    def execute(self, line):
+        """Runs a single command, returning its response without the trailing OK."""
+        command, args = split_command(line)
+
+        if command in READ_ONLY_COMMANDS:
+            response = self.responses.get(line)
+            if response is None:
+                response = READ_ONLY_COMMANDS[command](self, args)
+                self.responses[line] = response
+            return response
+
+        if command == 'add':
+            if not args:
+                raise CommandFailed(ACK_ERROR_ARG, 'Too few arguments for "add"')
+            if args[0] in self.files:
+                self.enqueue([args[0]])
+            else:
+                prefix = args[0].rstrip('/') + '/'
+                files = [track['file'] for track in self.tracks if track['file'].startswith(prefix)]
+                if not files:
+                    raise CommandFailed(ACK_ERROR_NO_EXIST, 'No such directory')
+                self.enqueue(files)
+        elif command == 'findadd':
+            self.enqueue([track['file'] for track in self.find(args)])
+        elif command == 'load':
+            if not args or args[0] not in self.playlists:
+                raise CommandFailed(ACK_ERROR_NO_EXIST, 'No such playlist')
+            self.enqueue(self.playlists[args[0]])
+        elif command == 'play':
+            with self.lock:
+                if self.queue:
+                    self.state = 'play'
+        elif command == 'clear':
+            with self.lock:
+                self.queue = []
+                self.state = 'stop'
+        elif command == 'status':
+            return self.status()
+        elif command == 'currentsong':
+            with self.lock:
+                if self.state != 'stop' and self.queue:
+                    return format_track(self.files[self.queue[0]])
+        elif command == 'ping':
+            pass
+        else:
+            raise CommandFailed(ACK_ERROR_UNKNOWN, 'unknown command "%s"' % command)
+
+        return ''
+
+
+READ_ONLY_COMMANDS = dict(
+    list=FakeMPDServer.list,
+    find=lambda server, args: format_tracks(server.find(args)),
+    listallinfo=lambda server, args: format_tracks(server.tracks),
+    lsinfo=FakeMPDServer.lsinfo,
+    count=FakeMPDServer.count,
+    stats=lambda server, args: server.stats(),
+    readcomments=lambda server, args: '',
+    listplaylists=lambda server, args: ''.join(
+        'playlist: %s\nLast-Modified: %s\n' % (name, LAST_MODIFIED) for name in server.playlists),
+)
+
+
+class FakeMPDHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        self.send('OK MPD %s\n' % VERSION)
+
+        command_list = None
+        list_ok = False
+
+        for raw in self.rfile:
+            line = raw.decode('utf-8').rstrip('\n')
+            command = line.split(' ', 1)[0].lower()
+
+            if command_list is not None:
+                if command == 'command_list_end':
+                    self.run_list(command_list, list_ok)
+                    command_list = None
+                else:
+                    command_list.append(line)
+                continue
+
+            if command in ('command_list_begin', 'command_list_ok_begin'):
+                command_list = []
+                list_ok = command == 'command_list_ok_begin'
+            elif command == 'close':
+                return
+            elif command == 'idle':
+                # Nothing ever changes, so just wait to be told to stop
+                if self.rfile.readline().strip() == b'noidle':
+                    self.send('OK\n')
+                else:
+                    return
+            else:
+                self.run_list([line], False)
+
+    def run_list(self, lines, list_ok):
+        output = []
+        for offset, line in enumerate(lines):
+            try:
+                output.append(self.server.execute(line))
+            except CommandFailed as e:
+                output.append('ACK [%d@%d] {%s} %s\n' % (e.code, offset, line.split(' ', 1)[0], e.message))
+                self.send(''.join(output))
+                return
+
+            if list_ok:
+                output.append('list_OK\n')
+
+        output.append('OK\n')
+        self.send(''.join(output))
+
+    def send(self, text):
+        self.wfile.write(text.encode('utf-8'))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--size', type=int, default=10000, help='Number of synthetic tracks to serve')
+    parser.add_argument('--port', type=int, default=6600)
+    args = parser.parse_args()
+
+    server = FakeMPDServer(make_tracks(args.size), address=('127.0.0.1', args.port))
+    print('Serving %d tracks on port %d' % (args.size, server.port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
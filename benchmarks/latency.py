@@ -0,0 +1,124 @@
+"""Measures end-to-end latency of rofi-mpd against a fake MPD server.
+
+Each mode is run as a separate process, the way it is launched from a key binding,
+with `benchmarks/stub/rofi` standing in for rofi and picking rows automatically.
+Reported times are medians, measured from process launch to the first row of the
+first menu and to the first queue change reaching the server.
+
+Run from the repository root:
+
+    python -m benchmarks.latency [--sizes 1000 10000 100000] [--modes w b t g l] [--cache]
+                                 [--think 0.5] [--no-prefetch] [--deferred-connect]
+"""
+
+import argparse
+import json
+import os.path
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import toml
+
+from .fake_mpd import FakeMPDServer, make_tracks
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STUB_DIR = os.path.join(ROOT, 'benchmarks', 'stub')
+
+# Rows picked in each menu, down to the track menu, whose first row is 'All'.
+# In --tracks mode that would queue the whole library, so a single track is picked instead.
+MODES = dict(
+    w=[0, 0, 0],
+    b=[0, 0],
+    t=[1],
+    g=[0, 0, 0],
+    l=[0],
+)
+
+
+def write_config(directory, port, cache, prefetch=True, deferred_connect=False):
+    config_dir = os.path.join(directory, 'config', 'rofi-mpd')
+    os.makedirs(config_dir, exist_ok=True)
+
+    with open(os.path.join(config_dir, 'config.toml'), 'w') as f:
+        toml.dump(dict(
+            music_directory=directory,
+            enable_disc_names=False,
+            play_on_add=True,
+            persistent_menus=False,
+            cache_enabled=cache,
+            prefetch=prefetch,
+            deferred_connect=deferred_connect,
+            hosts=[dict(host='127.0.0.1', port=port)]
+        ), f)
+
+
+def run_once(server, mode, directory, think=0):
+    """Runs rofi-mpd once, returning (time to first menu, time to queue) in seconds."""
+    log_path = os.path.join(directory, 'menus.log')
+    if os.path.exists(log_path):
+        os.remove(log_path)
+
+    env = dict(
+        os.environ,
+        PATH=STUB_DIR + os.pathsep + os.environ.get('PATH', ''),
+        PYTHONPATH=ROOT,
+        XDG_CONFIG_HOME=os.path.join(directory, 'config'),
+        XDG_CACHE_HOME=os.path.join(directory, 'cache'),
+        # Keep a daemon the user may be running out of it
+        XDG_RUNTIME_DIR=directory,
+        ROFI_STUB_LOG=log_path,
+        ROFI_STUB_SELECT=','.join(str(index) for index in MODES[mode]),
+        ROFI_STUB_THINK=str(think),
+    )
+
+    server.reset()
+    start = time.time()
+    subprocess.run([sys.executable, os.path.join(ROOT, 'bin', 'rofi-mpd'), '-' + mode], env=env, check=True)
+
+    with open(log_path) as f:
+        menus = [json.loads(line) for line in f]
+
+    if server.queued_at is None:
+        raise RuntimeError('-%s finished without queueing anything' % mode)
+
+    return menus[0]['first_row'] - start, server.queued_at - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--modes', nargs='+', choices=list(MODES), default=list(MODES))
+    parser.add_argument('--repeat', type=int, default=3, help='Timed runs per mode, after one warm-up run')
+    parser.add_argument('--cache', action='store_true', help='Enable the library snapshot cache')
+    parser.add_argument('--think', type=float, default=0, help='Seconds spent in each menu before picking a row')
+    parser.add_argument('--no-prefetch', action='store_true', help='Disable fetching the next menu in the background')
+    parser.add_argument('--deferred-connect', action='store_true',
+                        help='Open the first menu from the snapshot while connecting (needs --cache)')
+    args = parser.parse_args()
+
+    print('%10s %6s %12s %12s' % ('tracks', 'mode', 'first menu', 'queue'))
+    for size in args.sizes:
+        server = FakeMPDServer(make_tracks(size)).start()
+
+        with tempfile.TemporaryDirectory() as directory:
+            write_config(directory, server.port, args.cache, not args.no_prefetch, args.deferred_connect)
+
+            for mode in args.modes:
+                # Warms up the OS caches, the server's responses and the snapshot if enabled
+                run_once(server, mode, directory, args.think)
+                results = [run_once(server, mode, directory, args.think) for _ in range(args.repeat)]
+
+                print('%10d %6s %11.3fs %11.3fs' % (
+                    size,
+                    '-' + mode,
+                    statistics.median(result[0] for result in results),
+                    statistics.median(result[1] for result in results)))
+
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
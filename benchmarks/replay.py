@@ -0,0 +1,196 @@
+"""Serves a session recorded with `rofi-mpd --record FILE` back over the MPD protocol,
+and times `get_tracks()` (including `get_album()`) against it.
+
+Each request is answered with the response recorded for it, so the same session can be
+reproduced offline, without the original server. Requests which were never recorded get an error.
+
+Run from the repository root:
+
+    python -m benchmarks.replay FILE [--repeat 10]
+    python -m benchmarks.replay FILE --serve [--port 6600]
+"""
+
+import argparse
+import json
+import socketserver
+import statistics
+import threading
+import time
+from collections import deque
+
+
+def load_recording(path):
+    """Reads a recording, returning its command line, the config options it was recorded with,
+    its exchanges as (request lines, response lines) pairs, and its menu choices."""
+    argv = []
+    config = {}
+    exchanges = []
+    choices = []
+    hello = None
+
+    request = []
+    response = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            kind, _, text = line.rstrip('\n').partition(': ')
+
+            if kind == 'A':
+                argv = json.loads(text)
+            elif kind == 'O':
+                config = json.loads(text)
+            elif kind == 'M':
+                choices.append(json.loads(text))
+            elif kind == 'C':
+                if response:
+                    exchanges.append((tuple(request), response))
+                    request, response = [], []
+                request.append(text)
+            elif kind == 'S':
+                if not request and text.startswith('OK MPD '):
+                    hello = text
+                else:
+                    response.append(text)
+
+    if request:
+        exchanges.append((tuple(request), response))
+
+    return argv, config, hello or 'OK MPD 0.23.0', exchanges, choices
+
+
+class ReplayServer(socketserver.ThreadingTCPServer):
+    """Answers each request with the response recorded for it.
+
+    Requests made more than once are answered in the order they were recorded,
+    repeating the last answer once they run out. `reset()` starts over."""
+
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, hello, exchanges, address=('127.0.0.1', 0)):
+        super().__init__(address, ReplayHandler)
+        self.hello = hello
+        self.exchanges = exchanges
+        self.lock = threading.Lock()
+        self.reset()
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def reset(self):
+        with self.lock:
+            self.responses = {}
+            for request, response in self.exchanges:
+                self.responses.setdefault(request, deque()).append(
+                    ''.join(line + '\n' for line in response).encode('utf-8'))
+
+    def respond(self, request):
+        with self.lock:
+            responses = self.responses.get(request)
+            if not responses:
+                return ('ACK [5@0] {%s} not in recording\n' % request[0].split(' ', 1)[0]).encode('utf-8')
+            if len(responses) > 1:
+                return responses.popleft()
+            return responses[0]
+
+
+class ReplayHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        self.wfile.write(self.server.hello.encode('utf-8') + b'\n')
+
+        request = []
+        for raw in self.rfile:
+            line = raw.decode('utf-8').rstrip('\n')
+            request.append(line)
+
+            # Command lists are answered as a whole once they end
+            if request[0].startswith('command_list_') and line != 'command_list_end':
+                continue
+
+            if line == 'close':
+                return
+
+            self.wfile.write(self.server.respond(tuple(request)))
+            request = []
+
+
+class ScriptedRofi(object):
+    """Stands in for `Rofi`, picking the recorded choice in each menu."""
+
+    def __init__(self, choices):
+        self.choices = choices
+        self.position = 0
+
+    def select(self, prompt, options, select=None, multi_select=False, **kwargs):
+        # Rows are generated lazily, so build them as rofi would read them
+        options = list(options)
+
+        choice = self.choices[self.position] if self.position < len(self.choices) else None
+        self.position += 1
+
+        if choice is None:
+            return ([] if multi_select else -1), -1
+        if multi_select and not isinstance(choice, list):
+            choice = [choice]
+        return choice, 0
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('recording', help='File written by rofi-mpd --record')
+    parser.add_argument('--repeat', type=int, default=10)
+    parser.add_argument('--serve', action='store_true', help='Only serve the recording, until interrupted')
+    parser.add_argument('--port', type=int, default=6600, help='Port to serve on with --serve')
+    args = parser.parse_args()
+
+    argv, config, hello, exchanges, choices = load_recording(args.recording)
+
+    if args.serve:
+        server = ReplayServer(hello, exchanges, address=('127.0.0.1', args.port))
+        print('Replaying %d exchanges on port %d' % (len(exchanges), server.port))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+        return
+
+    from rofi_mpd import rofi_mpd
+
+    rofi_mpd.args = rofi_mpd.parser.parse_args(argv)
+    rofi_mpd.args.record = None
+
+    server = ReplayServer(hello, exchanges).start()
+    client = rofi_mpd.connect(dict(host='127.0.0.1', port=server.port))
+
+    times = []
+    for _ in range(args.repeat):
+        server.reset()
+        rofi = ScriptedRofi(choices)
+
+        start = time.perf_counter()
+        tracks, _ = rofi_mpd.get_tracks(client, rofi, window_size=config.get('track_window_size'),
+                                        max_resident=config.get('max_resident_tracks'))
+
+        # Windowed tracks are only fetched as they are read, as rofi reads the menu
+        count = sum(1 for _ in tracks)
+        times.append(time.perf_counter() - start)
+
+    client.disconnect()
+    server.stop()
+
+    print('%d tracks from %s' % (count, ' '.join(argv) or 'default mode'))
+    print('get_tracks(): median %.3fs, min %.3fs over %d runs' % (statistics.median(times), min(times), len(times)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+"""Compares the cost of sorting track lists into menu order.
+
+Run from the repository root:
+
+    python -m benchmarks.sort_tracks [--sizes 10000 100000 1000000]
+"""
+
+import argparse
+import random
+import time
+
+from rofi_mpd.library import sort_tracks, to_tracks
+
+
+def legacy_get_tag(tag: str, track):
+    # get_tag() as it was before tracks carried precomputed sort keys
+    if tag == 'track' or tag == 'disc':
+        func = int
+        default = 1
+    else:
+        func = str
+        default = 'N/A'
+
+    if tag in track:
+        value = track[tag]
+
+        if type(value) == list:
+            return func(value[0])
+        else:
+            return func(value)
+    else:
+        return default
+
+
+def legacy_sort(tracks):
+    tracks.sort(key=lambda t: (
+        legacy_get_tag('artist', t),
+        legacy_get_tag('album', t),
+        legacy_get_tag('disc', t),
+        legacy_get_tag('track', t)
+    ))
+
+
+def make_library(size, seed=0):
+    """Builds `size` track dicts shaped like python-mpd2's, in a shuffled order."""
+    rng = random.Random(seed)
+
+    tracks = []
+    for i in range(size):
+        artist = i // 120
+        album = i // 12
+        tracks.append({
+            'file': 'Artist %d/Album %d/%02d.flac' % (artist, album, i % 12 + 1),
+            'artist': 'Artist %d' % artist,
+            'album': 'Album %d' % album,
+            'title': 'Title %d' % i,
+            'date': str(1960 + artist % 60),
+            'disc': str(i % 12 // 6 + 1),
+            'track': str(i % 6 + 1),
+            'genre': 'Genre %d' % (artist % 20),
+        })
+
+    rng.shuffle(tracks)
+    return tracks
+
+
+def measure(func, tracks):
+    tracks = list(tracks)
+    start = time.perf_counter()
+    func(tracks)
+    return time.perf_counter() - start, tracks
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000, 1000000])
+    args = parser.parse_args()
+
+    print('%10s %12s %12s %12s %12s' % ('tracks', 'legacy', 'load', 'keyed', 'presorted'))
+    for size in args.sizes:
+        dicts = make_library(size)
+        legacy, expected = measure(legacy_sort, dicts)
+
+        # One-off cost paid while parsing the server's response
+        start = time.perf_counter()
+        tracks = to_tracks(dicts)
+        load = time.perf_counter() - start
+        del dicts
+
+        keyed, result = measure(sort_tracks, tracks)
+        assert [track['file'] for track in result] == [track['file'] for track in expected]
+
+        # Subsets of a snapshot, which is stored in menu order
+        presorted, _ = measure(sort_tracks, result)
+
+        print('%10d %11.3fs %11.3fs %11.3fs %11.3fs' % (size, legacy, load, keyed, presorted))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+"""Measures how long importing rofi-mpd takes, using `python -X importtime`.
+
+Every launch is a cold start, so this is paid on each key press. Fails if the import
+takes longer than the budget, or if a module which should only be imported on demand
+is imported at startup.
+
+Run from the repository root:
+
+    python -m benchmarks.startup [--repeat 10] [--budget 75]
+"""
+
+import argparse
+import os.path
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MODULE = 'rofi_mpd.rofi_mpd'
+
+# Modules only needed by some code paths, which must not be imported at startup
+LAZY_MODULES = ('mutagen', 'toml', 'appdirs', 'tracemalloc', 'rofi_mpd.daemon')
+
+
+def measure():
+    """Imports the module in a fresh interpreter, returning the cumulative
+    import time of each module in microseconds, in import order."""
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import ' + MODULE],
+                            cwd=ROOT, stderr=subprocess.PIPE, universal_newlines=True, check=True)
+
+    times = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or line.endswith('| imported package'):
+            continue
+
+        _, cumulative, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip())) // 2
+        times.append((name.strip(), depth, int(cumulative)))
+
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeat', type=int, default=10)
+    parser.add_argument('--budget', type=float, default=75, help='Maximum import time in milliseconds')
+    args = parser.parse_args()
+
+    runs = [measure() for _ in range(args.repeat)]
+
+    # The fastest run is the one least disturbed by everything else on the machine
+    best = min(runs, key=lambda times: dict((name, cumulative) for name, _, cumulative in times)[MODULE])
+    total = dict((name, cumulative) for name, _, cumulative in best)[MODULE] / 1000
+
+    # Modules are listed after everything they import, so the direct imports
+    # of the module are the ones just before it, back to the previous top-level module
+    direct = []
+    for name, depth, cumulative in reversed(best[:[name for name, _, _ in best].index(MODULE)]):
+        if depth == 0:
+            break
+        if depth == 1:
+            direct.append((name, cumulative))
+
+    print('Slowest imports:')
+    for name, cumulative in sorted(direct, key=lambda item: -item[1])[:10]:
+        print('  %-24s %7.1fms' % (name, cumulative / 1000))
+
+    print('import %s: %.1fms (budget %.1fms)' % (MODULE, total, args.budget))
+
+    failed = False
+    eager = sorted(set(name.split('.')[0] if name.split('.')[0] != 'rofi_mpd' else name
+                       for name, _, _ in best if name in LAZY_MODULES or name.split('.')[0] in LAZY_MODULES))
+    if eager:
+        print('Imported at startup, but should be imported on demand: %s' % ', '.join(eager))
+        failed = True
+
+    if total > args.budget:
+        print('Over budget by %.1fms' % (total - args.budget))
+        failed = True
+
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
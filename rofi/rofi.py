@@ -26,6 +26,7 @@
 import atexit
 from datetime import datetime
 from decimal import Decimal, InvalidOperation
+import os
 import signal
 import subprocess
 import time
@@ -111,6 +112,10 @@ class Rofi(object):
         # The Popen class returned for any non-blocking windows.
         self._process = None
 
+        # How many bytes of options to buffer before writing them to a
+        # streaming dialog.
+        self.stream_chunk_size = 64 * 1024
+
         # Save parameters.
         self.lines = lines
         self.fixed_lines = fixed_lines
@@ -238,6 +243,62 @@ class Rofi(object):
             return returncode, stdout
 
 
+    def _run_streaming(self, args, rows):
+        """Internal API: run a blocking command, streaming rows to its stdin.
+
+        This closes any open non-blocking dialog before running the command.
+        The process is started before the first row is produced, and rows are
+        written in chunks as the iterable yields them. If the process exits
+        before every row has been written (e.g., the user made a selection
+        early), the remaining rows are not consumed.
+
+        Parameters
+        ----------
+        args: Popen constructor arguments
+            Command to run.
+        rows: iterable of strings
+            Lines to feed to the stdin of the process, without newlines.
+
+        Returns
+        -------
+        (returncode, stdout)
+            The exit code (integer) and stdout value (string) from the process.
+
+        """
+        # Close any existing dialog.
+        if self._process:
+            self.close()
+
+        # Unbuffered, so nothing is left to flush (and fail) if the process
+        # exits before reading everything.
+        proc = subprocess.Popen(args, stdin=subprocess.PIPE, stdout=subprocess.PIPE, bufsize=0)
+        try:
+            chunk = []
+            size = 0
+            for row in rows:
+                line = (row + '\n').encode('utf-8')
+                chunk.append(line)
+                size += len(line)
+
+                # Write in reasonably sized blocks rather than a syscall per row.
+                if size >= self.stream_chunk_size:
+                    proc.stdin.write(b''.join(chunk))
+                    chunk = []
+                    size = 0
+
+            proc.stdin.write(b''.join(chunk))
+        except BrokenPipeError:
+            pass
+        finally:
+            proc.stdin.close()
+
+        stdout = proc.stdout.read()
+        proc.stdout.close()
+        returncode = proc.wait()
+
+        return returncode, stdout.decode('utf-8')
+
+
     def _run_nonblocking(self, args, input=None):
         """Internal API: run a non-blocking command with subprocess.
 
@@ -344,7 +405,7 @@ class Rofi(object):
         self._run_nonblocking(args)
 
 
-    def select(self, prompt, options, rofi_args=None, message="", select=None, **kwargs):
+    def select(self, prompt, options, rofi_args=None, message="", select=None, multi_select=False, **kwargs):
         """Show a list of options and return user selection.
 
         This method blocks until the user makes their choice.
@@ -353,14 +414,20 @@ class Rofi(object):
         ----------
         prompt: string
             The prompt telling the user what they are selecting.
-        options: list of strings
+        options: list of strings, or any other iterable of strings
             The options they can choose from. Any newline characters are
-            replaced with spaces.
+            replaced with spaces. If this is not a list or tuple, Rofi is
+            started straight away and options are streamed to it as they are
+            produced, so the first rows are shown before the rest exist.
         message: string, optional
             Message to show between the prompt and the options. This can
             contain Pango markup, and any text content should be escaped.
         select: integer, optional
             Set which option is initially selected.
+        multi_select: Boolean, optional
+            Allow several options to be selected at once (with Shift+Enter by
+            default). If set, a list of indices is returned instead of a single
+            index.
         keyN: tuple (string, string); optional
             Custom key bindings where N is one or greater. The first entry in
             the tuple should be a string defining the key, e.g., "Alt+x" or
@@ -379,20 +446,24 @@ class Rofi(object):
         -------
         tuple (index, key)
             The index of the option the user selected, or -1 if they cancelled
-            the dialog.
+            the dialog. With multi_select, a list of the selected indices,
+            which is empty if they cancelled the dialog.
             Key indicates which key was pressed, with 0 being 'OK' (generally
             Enter), -1 being 'Cancel' (generally escape), and N being custom
             key N.
 
         """
         rofi_args = rofi_args or []
-        # Replace newlines and turn the options into a single string.
-        optionstr = '\n'.join(option.replace('\n', ' ') for option in options)
+        streaming = not isinstance(options, (list, tuple))
 
         # Set up arguments.
         args = ['rofi', '-dmenu', '-p', prompt, '-format', 'i']
+        if streaming:
+            args.extend(['-async-pre-read', '25'])
         if select is not None:
             args.extend(['-selected-row', str(select)])
+        if multi_select:
+            args.append('-multi-select')
 
         # Key bindings to display.
         display_bindings = []
@@ -440,11 +511,20 @@ class Rofi(object):
         args.extend(rofi_args)
 
         # Run the dialog.
-        returncode, stdout = self._run_blocking(args, input=optionstr)
+        if streaming:
+            rows = (option.replace('\n', ' ') for option in options)
+            returncode, stdout = self._run_streaming(args, rows)
+        else:
+            # Replace newlines and turn the options into a single string.
+            optionstr = '\n'.join(option.replace('\n', ' ') for option in options)
+            returncode, stdout = self._run_blocking(args, input=optionstr)
 
         # Figure out which option was selected.
-        stdout = stdout.strip()
-        index = int(stdout) if stdout else -1
+        if multi_select:
+            index = [int(line) for line in stdout.split()]
+        else:
+            stdout = stdout.strip()
+            index = int(stdout) if stdout else -1
 
         # And map the return code to a key.
         if returncode == 0:
@@ -462,6 +542,112 @@ class Rofi(object):
         return index, key
 
 
+    def select_persistent(self, prompt, options, rofi_args=None, message="", select=None, **kwargs):
+        """Show a list of options which stays open after each selection.
+
+        Rather than starting a new Rofi process for every choice, this runs a
+        single instance in script mode. The rows are formatted once and
+        written to a file which the script replays back to Rofi after each
+        selection, while the selected index is passed back to us through a
+        FIFO.
+
+        If another dialog is opened while the generator is suspended, the
+        menu is re-opened when the generator is next resumed.
+
+        Parameters
+        ----------
+        prompt: string
+            The prompt telling the user what they are selecting.
+        options: list of strings
+            The options they can choose from. Any newline characters are
+            replaced with spaces.
+        message: string, optional
+            Message to show between the prompt and the options. This can
+            contain Pango markup, and any text content should be escaped.
+        select: integer, optional
+            Set which option is initially selected.
+
+        Yields
+        ------
+        integer
+            The index of each option the user selects, until they cancel the
+            dialog. After each selection, the following option is selected.
+
+        """
+        # Only needed here, and imported late so the first menu opens sooner.
+        import selectors
+        import shlex
+        import shutil
+        import tempfile
+
+        rofi_args = rofi_args or []
+        tmpdir = tempfile.mkdtemp(prefix='rofi-')
+        rows_path = os.path.join(tmpdir, 'rows')
+        fifo_path = os.path.join(tmpdir, 'selection')
+        script_path = os.path.join(tmpdir, 'menu')
+
+        # Mode options come first, then each option tagged with its index.
+        with open(rows_path, 'w') as f:
+            f.write('\0prompt\x1f{0:s}\n'.format(prompt.replace('\n', ' ')))
+            f.write('\0no-custom\x1ftrue\n')
+            f.write('\0keep-selection\x1ftrue\n')
+            if message:
+                f.write('\0message\x1f{0:s}\n'.format(message.replace('\n', ' ')))
+            for index, option in enumerate(options):
+                f.write('{0:s}\0info\x1f{1:d}\n'.format(option.replace('\n', ' '), index))
+
+        os.mkfifo(fifo_path)
+        with open(script_path, 'w') as f:
+            f.write('#!/bin/sh\n'
+                    'if [ "$ROFI_RETV" = 1 ] && [ -n "$ROFI_INFO" ]; then\n'
+                    '    echo "$ROFI_INFO" > {fifo}\n'
+                    '    printf "\\0new-selection\\037%d\\n" $((ROFI_INFO + 1))\n'
+                    'fi\n'
+                    'cat {rows}\n'.format(fifo=shlex.quote(fifo_path), rows=shlex.quote(rows_path)))
+        os.chmod(script_path, 0o700)
+
+        # Opening read-write means there is always a writer, so reads never hit EOF
+        # between invocations of the script.
+        fifo = os.open(fifo_path, os.O_RDWR | os.O_NONBLOCK)
+        selector = selectors.DefaultSelector()
+        selector.register(fifo, selectors.EVENT_READ)
+
+        def spawn(selected):
+            args = ['rofi', '-modi', 'menu:' + script_path, '-show', 'menu']
+            if selected is not None:
+                args.extend(['-selected-row', str(selected)])
+            args.extend(self._common_args(**kwargs))
+            args.extend(rofi_args)
+
+            self._run_nonblocking(args)
+            return self._process
+
+        process = spawn(select)
+        buffer = b''
+        try:
+            while True:
+                # Something else took over the screen while we were suspended.
+                if self._process is not process:
+                    process = spawn(index + 1)
+
+                if selector.select(timeout=0.1):
+                    buffer += os.read(fifo, 4096)
+                elif process.poll() is not None:
+                    break
+
+                while b'\n' in buffer:
+                    line, buffer = buffer.split(b'\n', 1)
+                    index = int(line)
+                    yield index
+
+        finally:
+            selector.close()
+            os.close(fifo)
+            shutil.rmtree(tmpdir, ignore_errors=True)
+            if self._process is process:
+                self.close()
+
+
     def generic_entry(self, prompt, validator=None, message=None, rofi_args=None, **kwargs):
         """A generic entry box.
 
@@ -1 +1,14 @@
-from .rofi_mpd import run
+import sys
+
+
+def run():
+    # Checked before importing the rest of the package, so handing over
+    # to a running daemon doesn't pay for mpd, mutagen and friends.
+    from .frontend import forward
+
+    status = forward(sys.argv[1:])
+    if status is not None:
+        sys.exit(status)
+
+    from .rofi_mpd import run
+    run()
@@ -0,0 +1,58 @@
+from mpd import CommandError
+
+
+class CommandBatchError(CommandError):
+    """Raised when a command inside a batch fails.
+
+    MPD stops executing a command list at the first failure,
+    so every command after `command` was not run either."""
+
+    def __init__(self, error: CommandError, command, args):
+        super().__init__(str(error))
+        self.failed_command = command
+        self.failed_args = args
+
+    def __str__(self):
+        return '%s %s: %s' % (self.failed_command, ' '.join(str(arg) for arg in self.failed_args),
+                              self.msg or super().__str__())
+
+
+class CommandBatch(object):
+    """Queues up MPD commands and sends them to the server in one round trip
+    using `command_list_ok_begin`/`command_list_end`."""
+
+    def __init__(self, client):
+        self.client = client
+        self.commands = []
+
+    def __len__(self):
+        return len(self.commands)
+
+    def add(self, command, *args):
+        self.commands.append((command, args))
+        return self
+
+    def send(self):
+        """Sends every queued command and returns a list of their results."""
+        commands, self.commands = self.commands, []
+
+        if not commands:
+            return []
+
+        # Don't pay for the command list framing on a lone command
+        if len(commands) == 1:
+            command, args = commands[0]
+            try:
+                return [getattr(self.client, command)(*args)]
+            except CommandError as e:
+                raise CommandBatchError(e, command, args) from e
+
+        self.client.command_list_ok_begin()
+        for command, args in commands:
+            getattr(self.client, command)(*args)
+
+        try:
+            return list(self.client.command_list_end())
+        except CommandError as e:
+            command, args = commands[e.offset or 0]
+            raise CommandBatchError(e, command, args) from e
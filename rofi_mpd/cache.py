@@ -0,0 +1,321 @@
+import marshal
+import os.path
+import posixpath
+import re
+import time
+
+from mpd import CommandError, FailureResponseCode
+
+from .batch import CommandBatch, CommandBatchError
+from .config import get_cache_dir, write_file
+from .library import Library, escape_filter_value, read_tracks, sort_tracks, to_tracks
+from .profiling import profiler
+
+# Directories with at most this many tracks are re-fetched outright
+# rather than searched for the exact sub-directory which changed
+REFETCH_LIMIT = 200
+
+# Bump whenever the layout of a snapshot changes so old files are discarded
+SNAPSHOT_VERSION = 3
+
+# Tracks fetched per request when listing the whole database
+FETCH_WINDOW = 10000
+
+
+def get_snapshot_path(host):
+    name = re.sub(r'[^\w.-]', '_', '%s_%s' % (host['host'], host.get('port', 6600)))
+    return os.path.join(get_cache_dir(), name + '.marshal')
+
+
+def load_snapshot(host):
+    """Returns the saved snapshot, or None if there isn't one.
+
+    A snapshot which was too large to keep holds only its size,
+    under 'oversized', in place of the library's index."""
+    path = get_snapshot_path(host)
+
+    if not os.path.exists(path):
+        return None
+
+    try:
+        with open(path, 'rb') as f:
+            # Far quicker than marshal.load(), which reads the file a few bytes at a time
+            snapshot = marshal.loads(f.read())
+    except (OSError, EOFError, ValueError, TypeError):
+        return None
+
+    if not isinstance(snapshot, dict) or snapshot.get('version') != SNAPSHOT_VERSION:
+        return None
+
+    return snapshot
+
+
+def save_snapshot(host, snapshot, config):
+    """Saves the snapshot. If it is over the configured size cap, only its size is saved,
+    so later launches can skip building it."""
+    path = get_snapshot_path(host)
+    data = marshal.dumps(snapshot)
+
+    if len(data) > get_max_size(config):
+        data = marshal.dumps(dict(
+            version=SNAPSHOT_VERSION,
+            db_update=snapshot['db_update'],
+            created=snapshot['created'],
+            oversized=dict(size=len(data), songs=len(snapshot['index']['epochs']))
+        ))
+
+    write_file(path, data)
+
+
+def get_max_size(config):
+    return config['cache_max_size'] * 1024 * 1024
+
+
+def is_oversized(snapshot, songs, config):
+    """Returns True if a library which was too large to keep last time
+    is still expected to be, going by how many songs it now has."""
+    oversized = snapshot['oversized']
+    return oversized['size'] * songs / max(oversized['songs'], 1) > get_max_size(config)
+
+
+def is_fresh(snapshot, db_update, config):
+    if snapshot is None or snapshot['db_update'] != db_update:
+        return False
+
+    return not is_expired(snapshot, config)
+
+
+def is_expired(snapshot, config):
+    ttl = config['cache_ttl']
+    return ttl and time.time() - snapshot['created'] >= ttl
+
+
+def fetch_tracks(client):
+    """Fetches every track in the database, a window at a time,
+    as a single response holding a large database can exceed MPD's output buffer."""
+    tracks = []
+    start = 0
+    try:
+        while True:
+            # Matches every track, as nothing was modified before the epoch
+            window = read_tracks(client, 'find', '(modified-since "0")',
+                                 'window', '%d:%d' % (start, start + FETCH_WINDOW))
+            tracks.extend(window)
+
+            if len(window) < FETCH_WINDOW:
+                return tracks
+            start += FETCH_WINDOW
+    except CommandError:
+        # Filter expressions need MPD 0.21 or newer
+        if start:
+            raise
+
+    return read_tracks(client, 'listallinfo')
+
+
+def get_directories(file):
+    """Returns every directory containing the file, from the root ('') down."""
+    directories = ['']
+    parts = file.split('/')[:-1]
+    for i in range(len(parts)):
+        directories.append('/'.join(parts[:i + 1]))
+
+    return directories
+
+
+def is_in_directory(file, directory):
+    return not directory or file.startswith(directory + '/')
+
+
+def count_tracks(client, directories):
+    """Returns a dict mapping each directory to how many tracks the server holds in it,
+    counting directories which no longer exist as empty."""
+    counts = {}
+    while directories:
+        batch = CommandBatch(client)
+        for directory in directories:
+            batch.add('count', '(base "%s")' % escape_filter_value(directory))
+
+        try:
+            results = batch.send()
+        except CommandBatchError as e:
+            if e.errno != FailureResponseCode.NO_EXIST:
+                raise
+
+            # MPD stops at the first failure, so count the rest again without the deleted directory
+            offset = e.offset or 0
+            counts[directories[offset]] = 0
+            directories = directories[:offset] + directories[offset + 1:]
+            continue
+
+        for directory, result in zip(directories, results):
+            counts[directory] = int(result.get('songs', 0))
+        break
+
+    return counts
+
+
+def find_in_directory(client, directory):
+    """Returns every track inside the directory, or none if it no longer exists."""
+    try:
+        return read_tracks(client, 'find', '(base "%s")' % escape_filter_value(directory))
+    except CommandError as e:
+        if e.errno != FailureResponseCode.NO_EXIST:
+            raise
+        return []
+
+
+def find_stale_directories(client, tracks, total):
+    """Compares per-directory track counts with the server to find where tracks have been deleted.
+
+    `tracks` must already include everything added or modified on the server,
+    so a directory holding fewer tracks on the server than locally has lost some.
+    Directories are only descended into when their own counts differ.
+
+    Returns a tuple of (directories to re-fetch entirely, a dict mapping
+    directories to re-fetch only the tracks directly inside to the sub-directories already known).
+    A directory with more tracks directly inside on the server may have gained
+    a sub-directory whose files are too old to be modified since the snapshot."""
+    counts = {}
+    children = {}
+    for file in tracks:
+        directories = get_directories(file)
+        for i, directory in enumerate(directories):
+            counts[directory] = counts.get(directory, 0) + 1
+            if i + 1 < len(directories):
+                children.setdefault(directory, set()).add(directories[i + 1])
+
+    # The root's count comes free with stats
+    server_counts = {'': total}
+    stale = []
+    stale_direct = {}
+
+    level = ['']
+    while level:
+        descend = []
+        for directory in level:
+            # An empty snapshot has no count even for the root, and is fetched in full
+            local = counts.get(directory, 0)
+            server = server_counts[directory]
+            if server == local:
+                continue
+
+            if local <= REFETCH_LIMIT or not server or directory not in children:
+                stale.append(directory)
+            else:
+                descend.append(directory)
+
+        level = [child for directory in descend for child in sorted(children[directory])]
+        server_counts.update(count_tracks(client, level))
+
+        # Tracks directly inside a directory don't belong to any child
+        for directory in descend:
+            local = counts[directory] - sum(counts[child] for child in children[directory])
+            server = server_counts[directory] - sum(server_counts[child] for child in children[directory])
+            if local != server:
+                stale_direct[directory] = children[directory]
+
+    return stale, stale_direct
+
+
+def refresh_tracks(client, snapshot, total):
+    """Brings the snapshot's tracks up to date, fetching only what changed since it was taken."""
+    tracks = {track['file']: track for track in Library(index=snapshot['index']).tracks}
+
+    for track in read_tracks(client, 'find', '(modified-since "%s")' % escape_filter_value(snapshot['db_update'])):
+        tracks[track['file']] = track
+
+    stale, stale_direct = find_stale_directories(client, tracks, total)
+
+    for directory in stale:
+        for file in [file for file in tracks if is_in_directory(file, directory)]:
+            del tracks[file]
+
+        for track in find_in_directory(client, directory) if directory else fetch_tracks(client):
+            tracks[track['file']] = track
+
+    for directory, known in stale_direct.items():
+        for file in [file for file in tracks if posixpath.dirname(file) == directory]:
+            del tracks[file]
+
+        with profiler.phase('query'):
+            entries = client.lsinfo(directory)
+
+        for track in to_tracks(entries):
+            tracks[track['file']] = track
+
+        # Sub-directories the snapshot has never seen are fetched in full
+        for entry in entries:
+            if 'directory' in entry and entry['directory'] not in known:
+                for track in find_in_directory(client, entry['directory']):
+                    tracks[track['file']] = track
+
+    return list(tracks.values())
+
+
+def get_snapshot_library(host):
+    """Returns a Library straight from the on-disk snapshot, without checking
+    it against the server, or None if there is no usable snapshot."""
+    snapshot = load_snapshot(host)
+    if snapshot is None or 'oversized' in snapshot:
+        return None
+
+    return Library(index=snapshot['index'])
+
+
+def get_library(client, host, config):
+    """Returns a Library for the host, served from the on-disk snapshot
+    if MPD's database has not been updated since it was taken.
+
+    If it has, only the tracks which changed are fetched, unless
+    the snapshot is older than the configured TTL.
+
+    Returns None if the snapshot was too large for the configured cap last time,
+    so the library is queried live instead without fetching all of it first.
+    A library found to be too large while building it is still returned,
+    as fetching it has already been paid for."""
+    stats = client.stats()
+    db_update = stats.get('db_update')
+    songs = int(stats.get('songs', 0))
+
+    snapshot = load_snapshot(host)
+    if snapshot is not None and 'oversized' in snapshot:
+        if is_oversized(snapshot, songs, config):
+            return None
+
+        # The library has shrunk enough that it may fit now
+        snapshot = None
+
+    if is_fresh(snapshot, db_update, config):
+        return Library(index=snapshot['index'])
+
+    tracks = None
+    created = time.time()
+    if snapshot is not None and not is_expired(snapshot, config):
+        try:
+            tracks = refresh_tracks(client, snapshot, songs)
+            created = snapshot['created']
+        except CommandError:
+            # modified-since needs MPD 0.21 or newer
+            pass
+
+    if tracks is None:
+        tracks = fetch_tracks(client)
+
+    # Stored in menu order, so filtered subsets come out already sorted
+    sort_tracks(tracks)
+    library = Library(tracks)
+
+    snapshot = dict(
+        version=SNAPSHOT_VERSION,
+        db_update=db_update,
+        created=created,
+        index=library.get_index()
+    )
+
+    try:
+        save_snapshot(host, snapshot, config)
+    except OSError:
+        pass
+
+    return library
@@ -1,7 +1,9 @@
+import marshal
 import os.path
+import sys
 
-import appdirs
-import toml
+APP_NAME = 'rofi-mpd'
+APP_AUTHOR = 'Jake Stanger'
 
 
 def load_default():
@@ -9,9 +11,27 @@ def load_default():
         music_directory='~/Music',
         case_sensitive=False,
         enable_disc_names=True,
+        disc_name_source='mpd',
+        disc_name_cache_size=10000,
+        disc_name_workers=8,
+        disc_name_timeout=2.0,
         tracks_keep_open=True,
         discs_keep_open=True,
         play_on_add=False,
+        persistent_menus=False,
+        multi_select=False,
+        cache_enabled=False,
+        cache_ttl=86400,
+        cache_max_size=64,
+        prefetch=True,
+        deferred_connect=False,
+        connect_timeout=5.0,
+        probe_hosts=True,
+        probe_timeout=0.5,
+        track_window_size=5000,
+        max_resident_tracks=50000,
+        metrics_enabled=False,
+        metrics_max_runs=1000,
         hosts=[
             dict(
                 host='localhost',
@@ -21,14 +41,94 @@ def load_default():
     )
 
 
+# On Linux the directories are worked out the same way appdirs does,
+# which saves importing it on every launch.
+
+def get_config_dir():
+    if sys.platform.startswith('linux'):
+        return os.path.join(os.getenv('XDG_CONFIG_HOME', os.path.expanduser('~/.config')), APP_NAME)
+
+    import appdirs
+    return appdirs.user_config_dir(APP_NAME, APP_AUTHOR)
+
+
+def get_cache_dir():
+    if sys.platform.startswith('linux'):
+        return os.path.join(os.getenv('XDG_CACHE_HOME', os.path.expanduser('~/.cache')), APP_NAME)
+
+    import appdirs
+    return appdirs.user_cache_dir(APP_NAME, APP_AUTHOR)
+
+
+def write_file(path, data):
+    """Writes data to a temporary file, then moves it into place,
+    so a concurrent launch never reads half a file."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    tmp_path = '%s.%d.tmp' % (path, os.getpid())
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def get_compiled_config_path():
+    return os.path.join(get_cache_dir(), 'config.marshal')
+
+
+def load_compiled_config(config_path, stat):
+    """Returns the config saved by `save_compiled_config()`,
+    or None if the config file has changed since (or it was never saved)."""
+    try:
+        with open(get_compiled_config_path(), 'rb') as f:
+            compiled = marshal.load(f)
+    except (OSError, EOFError, ValueError, TypeError):
+        return None
+
+    if not isinstance(compiled, dict) or compiled.get('source') != (config_path, stat.st_mtime_ns, stat.st_size):
+        return None
+
+    return compiled['config']
+
+
+def save_compiled_config(config_path, stat, config):
+    """Saves the parsed config in marshal format, which is much quicker
+    to load than parsing the TOML again (and importing a parser to do so)."""
+    path = get_compiled_config_path()
+
+    try:
+        data = marshal.dumps(dict(source=(config_path, stat.st_mtime_ns, stat.st_size), config=config))
+    except ValueError:
+        # Values such as TOML dates can't be marshalled, so the file is parsed every time
+        return
+
+    write_file(path, data)
+
+
 def load_config():
-    config_dir = appdirs.user_config_dir('rofi-mpd', 'Jake Stanger')
+    config_dir = get_config_dir()
     config_path = os.path.join(config_dir, 'config.toml')
 
-    if os.path.exists(config_path):
-        with open(config_path, 'r') as f:
-            config = toml.loads(f.read())
+    try:
+        stat = os.stat(config_path)
+    except FileNotFoundError:
+        stat = None
+
+    if stat is not None:
+        config = load_compiled_config(config_path, stat)
+
+        if config is None:
+            import toml
+
+            with open(config_path, 'r') as f:
+                config = toml.loads(f.read())
+
+            try:
+                save_compiled_config(config_path, stat, config)
+            except OSError:
+                pass
     else:
+        import toml
+
         config = load_default()
 
         if not os.path.exists(config_dir):
@@ -37,4 +137,5 @@ def load_config():
         with open(config_path, 'w') as f:
             toml.dump(config, f)
 
-    return config
+    # Fill in any options added since the config file was written
+    return {**load_default(), **config}
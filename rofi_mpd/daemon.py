@@ -0,0 +1,183 @@
+import json
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+import traceback
+
+from mpd import MPDError
+
+from . import rofi_mpd
+from .cache import fetch_tracks, get_library
+from .frontend import FORWARDED_ENV, get_socket_path
+from .library import Library
+from .metrics import get_mode, record_run
+from .profiling import profiler
+
+# Seconds to wait before reconnecting a watcher which lost its connection
+RECONNECT_DELAY = 5
+
+
+class HostState(object):
+    """Warm MPD connection and in-memory library for one host.
+
+    A second connection sits in `idle database` in the background
+    and rebuilds the library whenever MPD's database changes."""
+
+    def __init__(self, host, config):
+        self.host = host
+        self.config = config
+        self.client = None
+        self.library = None
+        self.lock = threading.Lock()
+
+        self.watcher = threading.Thread(target=self.watch, daemon=True)
+        self.watcher.start()
+
+    def get_client(self):
+        if self.client is not None:
+            try:
+                self.client.ping()
+                return self.client
+            except (MPDError, OSError):
+                # MPD drops connections which have been idle for too long
+                self.disconnect()
+
+        self.client = rofi_mpd.connect(self.host, timeout=self.config['connect_timeout'] or None)
+        return self.client
+
+    def disconnect(self):
+        try:
+            self.client.disconnect()
+        except (MPDError, OSError):
+            pass
+        self.client = None
+
+    def load_library(self, client):
+        # Kept in memory even when the snapshot is too large to save
+        library = get_library(client, self.host, self.config) if self.config['cache_enabled'] else None
+        if library is None:
+            library = Library(fetch_tracks(client))
+        return library
+
+    def get_library(self):
+        with self.lock:
+            if self.library is None:
+                self.library = self.load_library(self.get_client())
+            return self.library
+
+    def watch(self):
+        while True:
+            client = None
+            try:
+                client = rofi_mpd.connect(self.host, timeout=self.config['connect_timeout'] or None)
+                while True:
+                    client.idle('database')
+                    library = self.load_library(client)
+
+                    with self.lock:
+                        self.library = library
+            except (MPDError, OSError):
+                if client is not None:
+                    try:
+                        client.disconnect()
+                    except (MPDError, OSError):
+                        pass
+                time.sleep(RECONNECT_DELAY)
+
+
+def handle(conn, hosts, config):
+    with conn.makefile('rb') as f:
+        request = json.loads(f.readline().decode('utf-8'))
+
+    # Variables the client didn't send mustn't linger from an earlier client or from start-up
+    for key in FORWARDED_ENV:
+        os.environ.pop(key, None)
+    os.environ.update(request.get('env', {}))
+
+    status = 0
+    host = None
+    try:
+        rofi_mpd.args = rofi_mpd.parser.parse_args(request['argv'])
+        args = rofi_mpd.args
+
+        if config['metrics_enabled']:
+            profiler.start(trace_memory=False, startup=False)
+
+        rofi = rofi_mpd.get_rofi(config)
+        # The daemon already holds a connection to each host it has used
+        host, _ = rofi_mpd.get_host(config, rofi)
+
+        key = (host['host'], str(host['port']))
+        if key not in hosts:
+            hosts[key] = HostState(host, config)
+        state = hosts[key]
+
+        with profiler.phase('library'):
+            library = None if args.playlists or args.tracks else state.get_library()
+
+        with profiler.phase('connect'):
+            client = state.get_client()
+
+        rofi_mpd.browse(client, rofi, config, library)
+
+    # Cancelling a menu exits, as does bad usage
+    except SystemExit as e:
+        if e.code is None or isinstance(e.code, int):
+            status = e.code or 0
+        else:
+            print(e.code, file=sys.stderr)
+            status = 1
+    except Exception:
+        traceback.print_exc()
+        status = 1
+
+    if profiler.enabled:
+        if host is not None:
+            record_run(config, profiler.report(), get_mode(rofi_mpd.args), host)
+        profiler.stop()
+
+    try:
+        conn.sendall(json.dumps(dict(status=status)).encode('utf-8') + b'\n')
+    except OSError:
+        pass
+
+
+def serve(config):
+    """Listens for invocations forwarded by `frontend.forward()` and runs them
+    against warm connections, one at a time, until killed."""
+    path = get_socket_path()
+
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    if os.path.exists(path):
+        try:
+            server.connect(path)
+        except OSError:
+            # Left behind by a daemon which didn't shut down cleanly
+            os.remove(path)
+        else:
+            server.close()
+            sys.exit('rofi-mpd daemon is already running on %s' % path)
+
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+
+    server.bind(path)
+    os.chmod(path, 0o600)
+    server.listen()
+
+    # Make sure the socket is cleaned up when stopped by a service manager
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit())
+
+    hosts = {}
+    try:
+        while True:
+            conn, _ = server.accept()
+            with conn:
+                handle(conn, hosts, config)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+        os.remove(path)
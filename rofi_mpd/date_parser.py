@@ -1,8 +1,15 @@
-import datetime
+import re
 import time
+from functools import lru_cache
 
 LONG_TIME_AGO = -99999999999
 
+# YYYY, YYYY-MM or YYYY-MM-DD, separated by '-', '.' or '/',
+# optionally followed by a time as in full ISO 8601 timestamps
+DATE_PATTERN = re.compile(r'^(\d{1,4})(?:([-./])(\d{1,2})(?:\2(\d{1,2}))?)?(?:T.*)?$')
+
+DAYS_IN_MONTH = (31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31)
+
 
 def get_epoch_from_date(date):
     # Handle multi-tagged dates
@@ -12,27 +19,87 @@ def get_epoch_from_date(date):
     if type(date) == int:
         return date
 
+    return parse_date(date)
+
+
+def get_epochs_from_dates(dates):
+    """Converts a whole list of dates at once, parsing each distinct date only once."""
+    dates = [date[0] if isinstance(date, list) else date for date in dates]
+    epochs = {date: get_epoch_from_date(date) for date in set(dates)}
+    return [epochs[date] for date in dates]
+
+
+@lru_cache(maxsize=4096)
+def parse_date(date: str):
+    """Returns the UTC epoch of a date string. Albums share few distinct dates, so results are memoized."""
+    match = DATE_PATTERN.match(date)
+    if not match:
+        return parse_date_slow(date)
+
+    year, _, month, day = match.groups()
+    return get_epoch(int(year), int(month or 1), int(day or 1))
+
+
+def is_leap_year(year):
+    return year % 4 == 0 and (year % 100 != 0 or year % 400 == 0)
+
+
+def get_epoch(year, month, day):
+    """Same as `datetime(year, month, day, tzinfo=utc).timestamp()`,
+    with the same corrections as `parse_date_slow()`, but without building a datetime."""
+    # Very basic date validation and correction
+    if year < 1 or year > 9999:
+        year = 1
+    if month < 1 or month > 12:
+        month = 1
+    if day < 1 or day > 31:
+        day = 1
+
+    if day > DAYS_IN_MONTH[month - 1] and not (month == 2 and day == 29 and is_leap_year(year)):
+        return LONG_TIME_AGO
+
+    # Days since 1970-01-01 in the proleptic Gregorian calendar
+    y = year - 1 if month <= 2 else year
+    era = y // 400
+    year_of_era = y - era * 400
+    day_of_year = (153 * (month + (-3 if month > 2 else 9)) + 2) // 5 + day - 1
+    day_of_era = year_of_era * 365 + year_of_era // 4 - year_of_era // 100 + day_of_year
+    days = era * 146097 + day_of_era - 719468
+
+    return days * 86400
+
+
+def parse_date_slow(date: str):
+    import datetime
+
+    if not date:
+        return LONG_TIME_AGO
+
     if date.isnumeric():
         year = int(date)
         if year < 1 or year > 9999:
             year = 1
         epoch = datetime.datetime(year, 1, 1)
     else:
-        split_char: str
-        if '-' in date:
-            split_char = '-'
-        elif '.' in date:
-            split_char = '.'
+        split_char = None
+        for char in '-./':
+            if char in date:
+                split_char = char
+                break
 
         date_list = date.split(split_char)
 
         while len(date_list) < 3:
             date_list.append(1)
 
-        # Very basic date validation and correction
-        year = int(date_list[0])
-        month = int(date_list[1])
-        day = int(date_list[2])
+        try:
+            # Very basic date validation and correction
+            year = int(date_list[0])
+            month = int(date_list[1])
+            day = int(date_list[2])
+        except ValueError:
+            return LONG_TIME_AGO
+
         if year < 1 or year > 9999:
             year = 1
         if month < 1 or month > 12:
@@ -48,6 +115,7 @@ def get_epoch_from_date(date):
     return int(epoch.replace(tzinfo=datetime.timezone.utc).timestamp())
 
 
+@lru_cache(maxsize=4096)
 def get_epoch_as_year(epoch: int):
     if epoch == LONG_TIME_AGO:  # If album is missing year
         return 0
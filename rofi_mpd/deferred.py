@@ -0,0 +1,60 @@
+import threading
+import time
+from concurrent.futures import Future
+
+from mpd import MPDError
+
+from .profiling import profiler
+
+# Seconds between attempts while MPD refuses connections
+RETRY_INTERVAL = 0.25
+
+
+class DeferredClient(object):
+    """Stands in for an MPDClient while it connects in the background,
+    so menus served from the snapshot can open straight away.
+
+    The first use of the client waits for the connection. Failed attempts are
+    retried until the timeout runs out, or indefinitely without one,
+    which covers MPD still starting up. After that the last error is raised."""
+
+    def __init__(self, connect, timeout=None):
+        self.connect_timeout = timeout
+        self.connection = Future()
+
+        threading.Thread(target=self.work, args=(connect,), daemon=True).start()
+
+    def work(self, connect):
+        deadline = time.monotonic() + self.connect_timeout if self.connect_timeout else None
+
+        while True:
+            remaining = deadline - time.monotonic() if deadline is not None else None
+            try:
+                self.connection.set_result(connect(remaining))
+                return
+            except (MPDError, OSError) as e:
+                if remaining is not None and remaining <= RETRY_INTERVAL:
+                    self.connection.set_exception(e)
+                    return
+
+            time.sleep(RETRY_INTERVAL)
+
+    def get(self):
+        """Returns the connected client, waiting for it if needed."""
+        if not self.connection.done():
+            with profiler.phase('connect'):
+                return self.connection.result()
+
+        return self.connection.result()
+
+    # Set by read_tracks(), so it has to reach the real client rather than the proxy
+    @property
+    def iterate(self):
+        return self.get().iterate
+
+    @iterate.setter
+    def iterate(self, value):
+        self.get().iterate = value
+
+    def __getattr__(self, name):
+        return getattr(self.get(), name)
@@ -0,0 +1,120 @@
+import os.path
+import pickle
+import threading
+from collections import OrderedDict
+
+from .batch import CommandBatch, CommandBatchError
+from .config import get_cache_dir, write_file
+
+# Comments MPD may report a disc subtitle under, in order of preference
+SUBTITLE_COMMENTS = ('discsubtitle', 'tsst')
+
+
+def read_disc_subtitle(path):
+    """Reads the disc subtitle (`TSST` tag) from an audio file, returning '' if it has none."""
+    # Only needed once a disc menu is opened, so kept out of startup
+    import mutagen
+
+    try:
+        tags = mutagen.File(path)
+    except mutagen.MutagenError:
+        return ''
+
+    if tags is None:
+        return ''
+
+    subtitle = ''
+    if 'TSST' in tags:
+        subtitle += ': ' + tags['TSST'][0]
+    if 'TXXX:TSST' in tags:
+        subtitle += ': ' + tags['TXXX:TSST'][0]
+
+    return subtitle
+
+
+def read_disc_subtitles_from_mpd(client, files):
+    """Reads disc subtitles server-side with `readcomments`, in a single command list.
+
+    Returns a dict mapping each file to its subtitle ('' if it has none).
+    Files MPD fails to read are left out."""
+    subtitles = {}
+
+    while files:
+        batch = CommandBatch(client)
+        for file in files:
+            batch.add('readcomments', file)
+
+        try:
+            results = batch.send()
+        except CommandBatchError as e:
+            # MPD stops at the first failure, so retry without the failing file
+            offset = e.offset or 0
+            files = files[:offset] + files[offset + 1:]
+            continue
+
+        for file, comments in zip(files, results):
+            subtitle = ''
+            for key in SUBTITLE_COMMENTS:
+                if key in comments:
+                    value = comments[key]
+                    subtitle = ': ' + (value[0] if isinstance(value, list) else value)
+                    break
+
+            subtitles[file] = subtitle
+
+        break
+
+    return subtitles
+
+
+class DiscNameCache(object):
+    """Persistent LRU cache of disc subtitles.
+
+    Entries are keyed on file path and validated against the file's mtime and size,
+    so a cached subtitle is only re-read once the file itself has changed.
+    Safe to use from several threads at once."""
+
+    def __init__(self, max_entries, path=None):
+        self.max_entries = max_entries
+        self.path = path or os.path.join(get_cache_dir(), 'disc_names.pickle')
+        self.entries = OrderedDict()
+        self.dirty = False
+        self.lock = threading.Lock()
+
+        try:
+            with open(self.path, 'rb') as f:
+                self.entries = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ImportError):
+            pass
+
+    def get_subtitle(self, path):
+        stat = os.stat(path)
+        signature = (stat.st_mtime_ns, stat.st_size)
+
+        with self.lock:
+            entry = self.entries.get(path)
+            if entry is not None and entry[0] == signature:
+                self.entries.move_to_end(path)
+                return entry[1]
+
+        subtitle = read_disc_subtitle(path)
+
+        with self.lock:
+            self.entries[path] = (signature, subtitle)
+            self.entries.move_to_end(path)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+            self.dirty = True
+
+        return subtitle
+
+    def save(self):
+        with self.lock:
+            if not self.dirty:
+                return
+
+            data = pickle.dumps(self.entries, protocol=pickle.HIGHEST_PROTOCOL)
+            self.dirty = False
+
+        write_file(self.path, data)
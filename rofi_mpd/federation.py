@@ -0,0 +1,106 @@
+from mpd import MPDError
+
+from . import rofi_mpd
+from .cache import fetch_tracks, get_library
+from .library import Library, get_values, sort_tracks
+from .threads import run_each
+
+
+def get_track_key(track):
+    """Returns what identifies a track across hosts. The same music may be stored
+    under different paths on each host, so the file isn't part of it."""
+    return track.get_tag('artist'), track.get_tag('album'), track.disc_number, track.track_number, track.get('title')
+
+
+class FederatedLibrary(Library):
+    """The libraries of several hosts merged into one, listing each track once
+    no matter how many hosts have a copy of it."""
+
+    federated = True
+
+    def __init__(self, hosts, clients, libraries):
+        self.hosts = hosts
+        self.clients = clients
+
+        # Every host's copy of each track, as (host index, track) pairs
+        self.copies = {}
+
+        tracks = []
+        for index, library in enumerate(libraries):
+            for track in library.tracks:
+                key = get_track_key(track)
+
+                copies = self.copies.get(key)
+                if copies is None:
+                    copies = self.copies[key] = []
+                    tracks.append(track)
+                copies.append((index, track))
+
+        sort_tracks(tracks)
+        super().__init__(tracks)
+
+    def get_hosts(self, tracks):
+        """Returns the indices of the hosts with a copy of any of the tracks,
+        along with how many of the tracks each one has."""
+        counts = {}
+        for track in tracks:
+            for index, _ in self.copies[get_track_key(track)]:
+                counts[index] = counts.get(index, 0) + 1
+
+        return sorted(counts.items())
+
+    def album_hosts(self, albums, **filters):
+        """Returns a dict mapping each album to the names of the hosts with any of its tracks."""
+        indices = {album: set() for album in albums}
+        for track in self.find(**filters):
+            for album in get_values('album', track):
+                if album in indices:
+                    indices[album].update(index for index, _ in self.copies[get_track_key(track)])
+
+        return {album: [self.hosts[index]['host'] for index in sorted(found)] for album, found in indices.items()}
+
+    def get_client(self, track):
+        """Returns the connection to the host the listed copy of the track came from."""
+        return self.clients[self.copies[get_track_key(track)][0][0]]
+
+    def get_copies(self, tracks, index):
+        """Returns the host's own copies of the tracks, leaving out any it doesn't have."""
+        copies = []
+        for track in tracks:
+            for host_index, copy in self.copies[get_track_key(track)]:
+                if host_index == index:
+                    copies.append(copy)
+                    break
+
+        return copies
+
+
+def load_library(host, config):
+    client = rofi_mpd.connect(host, timeout=config['connect_timeout'] or None)
+
+    # Federating needs every track in memory, even when the snapshot is too large to keep
+    library = get_library(client, host, config) if config['cache_enabled'] else None
+    if library is None:
+        library = Library(fetch_tracks(client))
+    return client, library
+
+
+def load_federated_library(hosts, config):
+    """Loads every host's library at once, each on its own thread, so the wait
+    is as long as the slowest host rather than all of them added up.
+
+    Hosts which can't be reached are left out. Returns None if none could be."""
+    futures = run_each(lambda host: load_library(host, config), hosts)
+
+    reachable = []
+    for host, future in zip(hosts, futures):
+        try:
+            reachable.append((host, *future.result()))
+        except (MPDError, OSError):
+            continue
+
+    if not reachable:
+        return None
+
+    hosts, clients, libraries = zip(*reachable)
+    return FederatedLibrary(list(hosts), list(clients), libraries)
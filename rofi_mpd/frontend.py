@@ -0,0 +1,51 @@
+import json
+import os
+import socket
+import tempfile
+
+# Environment the daemon needs to open rofi on the caller's display
+FORWARDED_ENV = ('DISPLAY', 'WAYLAND_DISPLAY', 'XAUTHORITY')
+
+
+def get_socket_path():
+    runtime_dir = os.environ.get('XDG_RUNTIME_DIR') or tempfile.gettempdir()
+    return os.path.join(runtime_dir, 'rofi-mpd-%d.sock' % os.getuid())
+
+
+def forward(argv):
+    """Hands an invocation over to a running daemon.
+
+    This deliberately avoids importing anything heavier than the standard library.
+    Returns the exit status of the invocation, or None if no daemon is running."""
+    if '--daemon' in argv or '--stats' in argv or '-h' in argv or '--help' in argv:
+        return None
+
+    # Recordings and profiles are written by the process being measured
+    if any(arg.split('=', 1)[0] in ('--record', '--profile') for arg in argv):
+        return None
+
+    # The daemon serves one host per invocation
+    if '-f' in argv or '--federated' in argv:
+        return None
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(get_socket_path())
+    except OSError:
+        sock.close()
+        return None
+
+    with sock:
+        request = dict(
+            argv=argv,
+            env={key: os.environ[key] for key in FORWARDED_ENV if key in os.environ}
+        )
+        sock.sendall(json.dumps(request).encode('utf-8') + b'\n')
+
+        with sock.makefile('rb') as f:
+            response = f.readline()
+
+    if not response:
+        return 1
+
+    return json.loads(response.decode('utf-8'))['status']
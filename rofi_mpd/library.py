@@ -0,0 +1,335 @@
+import sys
+from collections import OrderedDict
+from operator import attrgetter
+
+from .date_parser import LONG_TIME_AGO, get_epochs_from_dates
+from .profiling import profiler
+
+# Tags whose values are shared between many tracks, and so are worth interning
+SHARED_TAGS = ('artist', 'albumartist', 'album', 'genre', 'date', 'disc')
+
+# Tags a Library can look rows up by without checking every track
+INDEXED_TAGS = ('artist', 'album', 'genre')
+
+
+def parse_number(value):
+    """Parses a disc or track number, allowing for forms such as '1/2'. Defaults to 1."""
+    if type(value) == list:
+        value = value[0]
+
+    if value.isdigit():
+        return int(value)
+
+    digits = ''
+    for char in value.strip():
+        if not char.isdigit():
+            break
+        digits += char
+
+    return int(digits) if digits else 1
+
+
+class Track(object):
+    """Compact stand-in for the dict python-mpd2 returns for each track.
+
+    Only the tags the menus use are kept, values shared between tracks are interned,
+    and disc and track numbers are parsed once up front. Supports the read-only
+    parts of the dict interface (`get`, `in`, `[]`) so it can be used anywhere a
+    track dict is."""
+
+    __slots__ = ('file', 'artist', 'albumartist', 'album', 'title', 'genre', 'date', 'disc', 'track',
+                 'disc_number', 'track_number', 'sort_key')
+
+    TAGS = __slots__[:9]
+
+    def __init__(self, file, artist=None, albumartist=None, album=None, title=None, genre=None, date=None,
+                 disc=None, track=None):
+        self.file = file
+        self.artist = artist
+        self.albumartist = albumartist
+        self.album = album
+        self.title = title
+        self.genre = genre
+        self.date = date
+        self.disc = disc
+        self.track = track
+
+        self.disc_number = parse_number(disc) if disc is not None else 1
+        self.track_number = parse_number(track) if track is not None else 1
+        self.sort_key = (self.get_tag('artist'), self.get_tag('album'), self.disc_number, self.track_number)
+
+    @classmethod
+    def from_dict(cls, values):
+        tags = {}
+        for tag in SHARED_TAGS:
+            value = values.get(tag)
+            if value is not None:
+                if type(value) == list:
+                    value = [sys.intern(v) for v in value]
+                else:
+                    value = sys.intern(value)
+                tags[tag] = value
+
+        return cls(values.get('file'), title=values.get('title'), track=values.get('track'), **tags)
+
+    def get(self, tag, default=None):
+        value = getattr(self, tag, None) if tag in self.TAGS else None
+        return default if value is None else value
+
+    def __contains__(self, tag):
+        return self.get(tag) is not None
+
+    def __getitem__(self, tag):
+        value = self.get(tag)
+        if value is None:
+            raise KeyError(tag)
+        return value
+
+    def get_tag(self, tag):
+        """Same as `get_tag(tag, track)`, but using the numbers parsed up front."""
+        if tag == 'disc':
+            return self.disc_number
+        if tag == 'track':
+            return self.track_number
+
+        value = self.get(tag)
+        if value is None:
+            return 'N/A'
+        if type(value) == list:
+            return value[0]
+        return value
+
+
+def get_sort_key(track):
+    """Returns the key tracks are ordered by in menus: artist, album, disc, then track number."""
+    if isinstance(track, Track):
+        return track.sort_key
+
+    values = [get_values(tag, track) for tag in ('artist', 'album', 'disc', 'track')]
+    return (
+        values[0][0] if values[0] else 'N/A',
+        values[1][0] if values[1] else 'N/A',
+        parse_number(values[2]) if values[2] else 1,
+        parse_number(values[3]) if values[3] else 1
+    )
+
+
+def sort_tracks(tracks):
+    """Sorts tracks into menu order in place.
+
+    Tracks carry a key computed once when they are loaded,
+    so sorting them costs no tag lookups or conversions."""
+    if all(isinstance(track, Track) for track in tracks):
+        tracks.sort(key=attrgetter('sort_key'))
+    else:
+        tracks.sort(key=get_sort_key)
+
+
+def read_tracks(client, command, *args):
+    """Runs a command which returns tracks, converting each track to a Track
+    as the response is parsed instead of building every dict first."""
+    iterate = client.iterate
+    client.iterate = True
+    try:
+        with profiler.phase('query'):
+            return to_tracks(getattr(client, command)(*args))
+    finally:
+        client.iterate = iterate
+
+
+class TrackWindows(object):
+    """Every track matching a filter, fetched a window at a time with
+    `find ... sort ... window`, so no single response holds the whole result.
+
+    Iterating streams the tracks in the server's sort order. At most max_resident tracks
+    are kept, as whole windows, dropping the least recently used window first.
+    Indexing a track which has been dropped fetches its window again."""
+
+    def __init__(self, client, expression, sort, size, max_resident):
+        self.client = client
+        self.expression = expression
+        self.sort = sort
+        self.size = size
+        self.max_windows = max(1, max_resident // size)
+        self.windows = OrderedDict()
+
+    def get_window(self, number):
+        window = self.windows.get(number)
+        if window is not None:
+            self.windows.move_to_end(number)
+            return window
+
+        start = number * self.size
+        window = read_tracks(self.client, 'find', self.expression, 'sort', self.sort,
+                             'window', '%d:%d' % (start, start + self.size))
+
+        self.windows[number] = window
+        if len(self.windows) > self.max_windows:
+            self.windows.popitem(last=False)
+
+        return window
+
+    def __iter__(self):
+        number = 0
+        while True:
+            window = self.get_window(number)
+            yield from window
+
+            if len(window) < self.size:
+                return
+            number += 1
+
+    def __getitem__(self, index):
+        return self.get_window(index // self.size)[index % self.size]
+
+
+def to_tracks(entries):
+    """Converts the track dicts of a (possibly iterated) python-mpd2 response to Tracks,
+    skipping any directories or playlists."""
+    return [Track.from_dict(entry) for entry in entries if 'file' in entry]
+
+
+def get_values(tag: str, track):
+    """Returns every value of a (possibly multi-valued) tag as a list."""
+    return get_column_values(track.get(tag))
+
+
+def get_column_values(value):
+    """Same as `get_values()`, for a value taken straight from a column."""
+    if value is None:
+        return []
+    if type(value) == list:
+        return value
+    return [value]
+
+
+def matches(track, filters):
+    """Returns True if the track has every tag/value pair in filters.
+
+    Mirrors MPD's `find` semantics, where a multi-valued tag matches
+    if any of its values does."""
+    for tag, value in filters.items():
+        if value not in get_values(tag, track):
+            return False
+
+    return True
+
+
+def escape_filter_value(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"')
+
+
+def get_filter_expression(filters):
+    """Builds an MPD filter expression matching every tag/value pair in filters."""
+    return '(%s)' % ' AND '.join(
+        '(%s == "%s")' % (tag, escape_filter_value(value)) for tag, value in filters.items())
+
+
+def build_index(tracks):
+    """Lays tracks out as one list per tag, along with the rows holding each artist,
+    album and genre and the epoch of each row's date (or None if it has none).
+
+    Made up only of lists, dicts, strings, numbers and None, so it can be saved with
+    `marshal`, which loads far quicker than unpickling a Track per row."""
+    columns = {tag: [track.get(tag) for track in tracks] for tag in Track.TAGS}
+
+    index = {}
+    for tag in INDEXED_TAGS:
+        rows = {}
+        for row, values in enumerate(columns[tag]):
+            for value in get_column_values(values):
+                rows.setdefault(value, []).append(row)
+        index[tag] = dict(sorted(rows.items()))
+
+    dated = [(row, get_column_values(value)[0]) for row, value in enumerate(columns['date']) if value]
+    epochs = [None] * len(tracks)
+    for (row, _), epoch in zip(dated, get_epochs_from_dates([date for _, date in dated])):
+        epochs[row] = epoch
+
+    return dict(columns=columns, index=index, epochs=epochs)
+
+
+class Library(object):
+    """In-memory view of the MPD database.
+
+    Answers the same questions `get_tracks()` would otherwise ask the server,
+    from the layout `build_index()` makes of a full listing of the database.
+    Tracks are only built for the rows a query returns, unless every track is asked for.
+    """
+
+    # Whether the tracks come from several hosts (see `FederatedLibrary`)
+    federated = False
+
+    def __init__(self, tracks=None, index=None):
+        self._tracks = tracks
+        if index is None:
+            index = build_index(tracks)
+
+        self.columns = index['columns']
+        self.index = index['index']
+        self.epochs = index['epochs']
+        self.size = len(self.epochs)
+        self._index = index
+
+        # Results of list(), which a long-running process asks for repeatedly
+        self._lists = {}
+
+    def get_index(self):
+        """Returns the layout the library was built from, for saving with `marshal`."""
+        return self._index
+
+    @property
+    def tracks(self):
+        if self._tracks is None:
+            self._tracks = [Track(*values) for values in zip(*(self.columns[tag] for tag in Track.TAGS))]
+        return self._tracks
+
+    def get_track(self, row):
+        if self._tracks is not None:
+            return self._tracks[row]
+        return Track(*(self.columns[tag][row] for tag in Track.TAGS))
+
+    def find_rows(self, **filters):
+        """Returns the rows of every track matching all filters, in order."""
+        if not filters:
+            return range(self.size)
+
+        # Start from the fewest rows any indexed tag allows, then check the other filters
+        indexed = [self.index[tag].get(value, []) for tag, value in filters.items() if tag in self.index]
+        rows = min(indexed, key=len) if indexed else range(self.size)
+
+        return [row for row in rows
+                if all(value in get_column_values(self.columns[tag][row]) for tag, value in filters.items())]
+
+    def list(self, tag, **filters):
+        """Equivalent of `client.list(tag, ...)`, returning a sorted list of distinct values."""
+        if not filters and tag in self.index:
+            return list(self.index[tag])
+
+        key = (tag, tuple(sorted(filters.items())))
+        if key in self._lists:
+            return self._lists[key]
+
+        column = self.columns[tag]
+        values = set()
+        for row in self.find_rows(**filters):
+            values.update(get_column_values(column[row]))
+
+        self._lists[key] = sorted(values)
+        return self._lists[key]
+
+    def find(self, **filters):
+        """Equivalent of `client.find(...)`, returning every track matching all filters."""
+        return [self.get_track(row) for row in self.find_rows(**filters)]
+
+    def album_dates(self, albums, artist=None):
+        """Returns a dict mapping each album to the earliest date of its tracks.
+
+        Albums without any dated track map to `LONG_TIME_AGO`."""
+        dates = {}
+        for album in albums:
+            rows = self.find_rows(album=album) if artist is None else self.find_rows(album=album, artist=artist)
+            epochs = [self.epochs[row] for row in rows if self.epochs[row] is not None]
+            dates[album] = min(epochs) if epochs else LONG_TIME_AGO
+
+        return dates
@@ -0,0 +1,140 @@
+import fcntl
+import json
+import os.path
+import time
+
+from .config import get_cache_dir
+
+# Every record takes up exactly this many bytes, so the oldest can be overwritten in place
+SLOT_SIZE = 512
+
+# Profiler phases making up each reported phase
+PHASES = dict(
+    startup=('startup', 'config'),
+    connect=('connect',),
+    fetch=('library', 'query'),
+    menu=('dates', 'sort', 'menu', 'disc_names'),
+    queue=('queue',),
+)
+
+PERCENTILES = (50, 95, 99)
+
+
+def get_metrics_path():
+    return os.path.join(get_cache_dir(), 'metrics.ring')
+
+
+def get_mode(args):
+    for mode in ('albums', 'tracks', 'genres', 'playlists'):
+        if getattr(args, mode):
+            return mode
+    return 'artists'
+
+
+def summarise(report, mode, host):
+    """Reduces a profiler report to a metrics record, in milliseconds."""
+    phases = report['phases']
+
+    record = dict(time=int(time.time()), mode=mode, host='%s:%s' % (host['host'], host['port']), phases={})
+    for name, parts in PHASES.items():
+        if any(part in phases for part in parts):
+            record['phases'][name] = round(sum((phases[part]['wall'] or 0) * 1000
+                                               for part in parts if part in phases), 1)
+    record['phases']['total'] = round(report['total']['wall'] * 1000, 1)
+
+    return record
+
+
+class MetricsLog(object):
+    """Fixed-size ring of run records on disk.
+
+    The first slot holds the index of the next slot to write,
+    so once the ring is full each new record replaces the oldest."""
+
+    def __init__(self, path, max_runs):
+        self.path = path
+        self.max_runs = max_runs
+
+    def append(self, record):
+        data = json.dumps(record, separators=(',', ':')).encode('utf-8')
+        if len(data) >= SLOT_SIZE:
+            return
+
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        with os.fdopen(fd, 'r+b') as f:
+            # Launches can overlap, so only one may write at once
+            fcntl.flock(f, fcntl.LOCK_EX)
+
+            try:
+                index = int(f.read(SLOT_SIZE).strip() or 0) % self.max_runs
+            except ValueError:
+                index = 0
+
+            f.seek((index + 1) * SLOT_SIZE)
+            f.write(data.ljust(SLOT_SIZE - 1) + b'\n')
+
+            f.seek(0)
+            f.write(str((index + 1) % self.max_runs).encode('utf-8').ljust(SLOT_SIZE - 1) + b'\n')
+
+            # Drop slots left over from a larger ring
+            size = (self.max_runs + 1) * SLOT_SIZE
+            if os.fstat(f.fileno()).st_size > size:
+                f.truncate(size)
+
+    def read(self):
+        """Returns every record in the ring, oldest first."""
+        try:
+            with open(self.path, 'rb') as f:
+                fcntl.flock(f, fcntl.LOCK_SH)
+                f.read(SLOT_SIZE)
+                data = f.read()
+        except OSError:
+            return []
+
+        records = []
+        for offset in range(0, len(data), SLOT_SIZE):
+            try:
+                records.append(json.loads(data[offset:offset + SLOT_SIZE].decode('utf-8')))
+            except ValueError:
+                continue
+
+        records.sort(key=lambda record: record.get('time', 0))
+        return records
+
+
+def record_run(config, report, mode, host):
+    try:
+        MetricsLog(get_metrics_path(), config['metrics_max_runs']).append(summarise(report, mode, host))
+    except OSError:
+        pass
+
+
+def get_percentile(values, percentile):
+    """Nearest-rank percentile of a sorted list."""
+    rank = max(1, -(-percentile * len(values) // 100))
+    return values[rank - 1]
+
+
+def print_stats(config):
+    records = MetricsLog(get_metrics_path(), config['metrics_max_runs']).read()
+    if not records:
+        print('No runs recorded. Set metrics_enabled = true in the config to record them.')
+        return
+
+    groups = {}
+    for record in records:
+        groups.setdefault((record['mode'], record['host']), []).append(record)
+
+    for (mode, host), group in sorted(groups.items()):
+        print('%s on %s (%d runs)' % (mode, host, len(group)))
+        print('  %-8s %9s %9s %9s' % ('phase', *('p%d' % percentile for percentile in PERCENTILES)))
+
+        for phase in (*PHASES, 'total'):
+            values = sorted(record['phases'][phase] for record in group if phase in record['phases'])
+            if values:
+                print('  %-8s %s' % (phase, ' '.join(
+                    '%7.1fms' % get_percentile(values, percentile) for percentile in PERCENTILES)))
+
+        print()
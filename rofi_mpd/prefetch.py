@@ -0,0 +1,108 @@
+import os
+import socket
+import threading
+from concurrent.futures import CancelledError, Future
+from queue import Queue
+
+from mpd import MPDClient, MPDError
+
+# Seconds a background request may take before it is abandoned
+TIMEOUT = 10
+
+
+class Prefetcher(object):
+    """Runs requests on a second MPD connection in the background,
+    so the next menu's data can be fetched while the current menu is open.
+
+    Requests run one at a time, in the order they were submitted, and only while
+    the prefetcher is released. MPD answers one request at a time and both threads
+    share the GIL, so it is held while a menu is being built and released once rofi has it.
+    The worker is a daemon thread, so a request still in flight never holds up exiting."""
+
+    def __init__(self, host):
+        self.host = host
+        self.client = None
+        self.futures = []
+        self.tasks = Queue()
+        self.released = threading.Event()
+
+        threading.Thread(target=self.work, daemon=True).start()
+
+    def submit(self, func, *args):
+        """Queues `func(client, *args)`, returning a future for its result."""
+        future = Future()
+        self.futures.append(future)
+        self.tasks.put((future, func, args))
+        return future
+
+    def result(self, future):
+        """Returns the result of a request if it has already arrived, or None.
+
+        Requests still in flight are not waited for, as asking the server directly
+        for just what is needed is never slower than waiting for a bigger prefetch.
+        A request which hasn't started yet is cancelled, as nothing will use it."""
+        if not future.done():
+            future.cancel()
+            return None
+
+        try:
+            return future.result()
+        except (MPDError, OSError, CancelledError):
+            return None
+
+    def release(self):
+        """Lets queued requests run."""
+        self.released.set()
+
+    def hold(self):
+        """Stops queued requests from starting until `release()` is called.
+        A request which is already running is left to finish."""
+        self.released.clear()
+
+    def work(self):
+        while True:
+            future, func, args = self.tasks.get()
+            if future is None:
+                break
+
+            self.released.wait()
+
+            if not future.set_running_or_notify_cancel():
+                continue
+
+            try:
+                if self.client is None:
+                    client = MPDClient()
+                    client.timeout = TIMEOUT
+                    client.connect(self.host['host'], self.host['port'])
+                    self.client = client
+
+                future.set_result(func(self.client, *args))
+            except Exception as e:
+                future.set_exception(e)
+
+        self.disconnect()
+
+    def cancel(self):
+        """Abandons any outstanding requests and closes the connection."""
+        for future in self.futures:
+            future.cancel()
+        self.tasks.put((None, None, None))
+        self.released.set()
+
+        client = self.client
+        if client is not None:
+            try:
+                # Shutting the socket down interrupts a response which is still being read
+                with socket.socket(fileno=os.dup(client.fileno())) as sock:
+                    sock.shutdown(socket.SHUT_RDWR)
+            except (MPDError, OSError):
+                pass
+
+    def disconnect(self):
+        if self.client is not None:
+            try:
+                self.client.disconnect()
+            except (MPDError, OSError):
+                pass
+            self.client = None
@@ -0,0 +1,94 @@
+import time
+from concurrent.futures import TimeoutError
+
+from mpd import MPDClient, MPDError
+
+from .threads import run_each
+
+
+class Probe(object):
+    """What probing a host found: an open connection if it answered,
+    along with how long it took and what it is playing."""
+
+    def __init__(self, host):
+        self.host = host
+        self.client = None
+        self.latency = None
+        self.status = None
+        self.current = None
+        self.error = None
+
+    def describe(self):
+        """Returns the host's row in the host menu."""
+        if self.client is None:
+            return '%s  (unreachable: %s)' % (self.host['host'], self.error)
+
+        state = self.status.get('state', 'stop')
+        if state == 'stop' or not self.current:
+            playing = 'stopped'
+        else:
+            playing = '%s %s - %s' % ('playing' if state == 'play' else 'paused',
+                                      self.current.get('artist', '?'), self.current.get('title', '?'))
+
+        return '%s  (%dms, %s)' % (self.host['host'], self.latency * 1000, playing)
+
+
+def probe(host, timeout):
+    """Connects to the host and asks what it is playing, giving up after timeout seconds."""
+    result = Probe(host)
+    start = time.perf_counter()
+
+    client = MPDClient()
+    client.timeout = timeout
+    try:
+        client.connect(host['host'], host['port'])
+
+        client.command_list_ok_begin()
+        client.status()
+        client.stats()
+        client.currentsong()
+        result.status, _, result.current = client.command_list_end()
+    except (MPDError, OSError) as e:
+        result.error = getattr(e, 'strerror', None) or str(e) or type(e).__name__
+        try:
+            client.disconnect()
+        except (MPDError, OSError):
+            pass
+        return result
+
+    result.latency = time.perf_counter() - start
+    client.timeout = None
+    result.client = client
+    return result
+
+
+def probe_hosts(hosts, timeout):
+    """Probes every host at once, each on its own thread.
+
+    Returns a future per host, in the same order."""
+    return run_each(lambda host: probe(host, timeout), hosts)
+
+
+def get_probe(future, host, deadline):
+    """Waits for a probe until the deadline, counting the host as unreachable if it takes longer."""
+    try:
+        return future.result(max(0, deadline - time.monotonic()))
+    except TimeoutError:
+        result = Probe(host)
+        result.error = 'timed out'
+        return result
+
+
+def close_probes(futures, keep=None):
+    """Disconnects every probed host's connection other than keep,
+    including those of probes which are still running."""
+    def close(future):
+        client = future.result().client
+        if client is not None and client is not keep:
+            try:
+                client.disconnect()
+            except (MPDError, OSError):
+                pass
+
+    for future in futures:
+        future.add_done_callback(close)
@@ -0,0 +1,135 @@
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+# Phases which are reported but not counted towards the total
+EXCLUDED_PHASES = ('rofi',)
+
+
+def get_process_age():
+    """Returns how long ago the process started in seconds, or None where /proc is unavailable."""
+    try:
+        with open('/proc/self/stat') as f:
+            # The command name may contain spaces, so count fields from the end of it
+            fields = f.read().rsplit(')', 1)[1].split()
+        with open('/proc/uptime') as f:
+            uptime = float(f.read().split()[0])
+        return uptime - int(fields[19]) / os.sysconf('SC_CLK_TCK')
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class Profiler(object):
+    """Accumulates wall-clock time, CPU time and peak traced memory per named phase.
+
+    Phases nest, and time is only ever counted towards the innermost one,
+    so the phases add up to the whole run. Does nothing until `start()` is called,
+    and only the main thread is measured."""
+
+    def __init__(self):
+        self.enabled = False
+        self.trace_memory = False
+        self.phases = {}
+        self.stack = []
+        self.mark = None
+
+    def start(self, trace_memory=True, startup=True):
+        """Starts measuring, from scratch. Unless startup is False,
+        everything before this call is reported as the startup phase."""
+        self.phases = {}
+        if startup:
+            self.phases['startup'] = dict(wall=get_process_age(), cpu=time.process_time(), peak_memory=None, calls=1)
+
+        self.trace_memory = trace_memory
+        if trace_memory:
+            import tracemalloc
+            tracemalloc.start()
+
+        self.enabled = True
+        self.stack = ['other']
+        self.mark = (time.perf_counter(), time.process_time())
+
+    def switch(self):
+        """Charges everything since the last switch to the current phase."""
+        wall, cpu = time.perf_counter(), time.process_time()
+
+        phase = self.phases.setdefault(self.stack[-1], dict(wall=0, cpu=0, peak_memory=None, calls=0))
+        phase['wall'] += wall - self.mark[0]
+        phase['cpu'] += cpu - self.mark[1]
+
+        if self.trace_memory:
+            import tracemalloc
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.reset_peak()
+            phase['peak_memory'] = max(phase['peak_memory'] or 0, peak)
+
+        self.mark = (wall, cpu)
+
+    @contextmanager
+    def phase(self, name):
+        if not self.enabled or threading.current_thread() is not threading.main_thread():
+            yield
+            return
+
+        self.switch()
+        self.stack.append(name)
+        try:
+            yield
+        finally:
+            self.switch()
+            self.phases[self.stack.pop()]['calls'] += 1
+
+    def iterate(self, name, iterable):
+        """Yields from iterable, counting the time spent producing each item towards the phase."""
+        iterator = iter(iterable)
+        while True:
+            with self.phase(name):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+
+    def stop(self):
+        if self.enabled:
+            self.switch()
+            self.enabled = False
+
+        if self.trace_memory:
+            import tracemalloc
+            tracemalloc.stop()
+            self.trace_memory = False
+
+    def report(self):
+        if self.enabled:
+            self.switch()
+
+        phases = {name: dict(phase) for name, phase in self.phases.items()}
+        counted = [phase for name, phase in phases.items() if name not in EXCLUDED_PHASES]
+
+        return dict(
+            argv=sys.argv[1:],
+            total=dict(
+                wall=sum(phase['wall'] or 0 for phase in counted),
+                cpu=sum(phase['cpu'] for phase in counted),
+                peak_memory=max((phase['peak_memory'] or 0 for phase in counted), default=0)
+            ),
+            excluded=list(EXCLUDED_PHASES),
+            phases=phases
+        )
+
+    def write(self, path):
+        """Writes the report as JSON to a file, or to stderr if path is '-'."""
+        report = json.dumps(self.report(), indent=2)
+
+        if path == '-':
+            print(report, file=sys.stderr)
+        else:
+            with open(path, 'w') as f:
+                f.write(report + '\n')
+
+
+profiler = Profiler()
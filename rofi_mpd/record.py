@@ -0,0 +1,89 @@
+import json
+import threading
+
+from rofi import Rofi
+
+# Prefixes of each line in a recording
+ARGV = 'A'
+CONFIG = 'O'
+CLIENT = 'C'
+SERVER = 'S'
+MENU = 'M'
+
+
+class Recorder(object):
+    """Writes the MPD protocol exchange of a session to a file, line by line,
+    along with the command line it was started with, the config options
+    which shape its requests, and every menu choice made.
+
+    Recordings can be served back by `benchmarks.replay`."""
+
+    def __init__(self, path, argv, config=None):
+        self.file = open(path, 'w', encoding='utf-8')
+        self.lock = threading.Lock()
+        self.write(ARGV, json.dumps(argv))
+        self.write(CONFIG, json.dumps(config or {}))
+
+    def write(self, kind, line):
+        with self.lock:
+            self.file.write('%s: %s\n' % (kind, line))
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+    def attach(self, client):
+        """Starts recording a connected `MPDClient`."""
+        # The greeting has already been read by connect()
+        self.write(SERVER, 'OK MPD %s' % client.mpd_version)
+
+        client._rbfile = RecordingReader(client._rbfile, self)
+        client._wfile = RecordingWriter(client._wfile, self)
+
+
+class RecordingReader(object):
+    def __init__(self, file, recorder):
+        self.file = file
+        self.recorder = recorder
+
+    def readline(self):
+        line = self.file.readline()
+        self.recorder.write(SERVER, line.decode('utf-8').rstrip('\n'))
+        return line
+
+    def __getattr__(self, name):
+        return getattr(self.file, name)
+
+
+class RecordingWriter(object):
+    def __init__(self, file, recorder):
+        self.file = file
+        self.recorder = recorder
+
+    def write(self, text):
+        for line in text.splitlines():
+            self.recorder.write(CLIENT, line)
+        return self.file.write(text)
+
+    def __getattr__(self, name):
+        return getattr(self.file, name)
+
+
+class RecordingRofi(Rofi):
+    """Rofi which also records the options picked in each menu."""
+
+    def __init__(self, recorder, **kwargs):
+        super().__init__(**kwargs)
+        self.recorder = recorder
+
+    def select(self, prompt, options, *args, **kwargs):
+        index, key = super().select(prompt, options, *args, **kwargs)
+        self.recorder.write(MENU, json.dumps(index if key != -1 else None))
+        return index, key
+
+    def select_persistent(self, prompt, options, *args, **kwargs):
+        for index in super().select_persistent(prompt, options, *args, **kwargs):
+            self.recorder.write(MENU, json.dumps(index))
+            yield index
+
+        self.recorder.write(MENU, json.dumps(None))
@@ -1,15 +1,25 @@
 #!/usr/bin/env python3
 
 import argparse
+import itertools
 import os.path
 import sys
+import threading
+import time
+from queue import Empty, Queue
 
-import mutagen
-from mpd import MPDClient
+from mpd import CommandError, MPDClient, MPDError
 
 from rofi import Rofi
+from .batch import CommandBatch, CommandBatchError
+from .cache import get_library, get_snapshot_library
 from .config import load_config
-from .date_parser import LONG_TIME_AGO, get_epoch_from_date, get_epoch_as_year
+from .disc_names import DiscNameCache, read_disc_subtitle, read_disc_subtitles_from_mpd
+from .date_parser import LONG_TIME_AGO, get_epoch_from_date, get_epochs_from_dates, get_epoch_as_year
+from .library import Library, Track, TrackWindows, get_filter_expression, matches, read_tracks, sort_tracks
+from .metrics import get_mode, print_stats, record_run
+from .profiling import profiler
+from .record import Recorder, RecordingRofi
 
 parser = argparse.ArgumentParser()
 parser.add_argument('-w', '--artists', action='store_true', help='Start at a list of all artists. This is the default')
@@ -18,6 +28,9 @@ parser.add_argument('-t', '--tracks', action='store_true', help='Start at a list
 parser.add_argument('-g', '--genres', action='store_true', help='Start at a list of genres')
 parser.add_argument('-l', '--playlists', action='store_true', help='Show a list of playlists to load')
 
+parser.add_argument('-f', '--federated', action='store_true', help='Browse the libraries of every configured host '
+                                                                   'together, choosing which one to queue on')
+
 parser.add_argument('-m', '--music-directory', help='Path to your music library')
 
 parser.add_argument('-c', '--host', help='Use the specified MPD host')
@@ -30,14 +43,37 @@ parser.add_argument('--noplay', action='store_false', help='Do not start playbac
 
 parser.add_argument('-i', '--case-sensitive', action='store_true', help='Enable case sensitivity')
 
+parser.add_argument('--daemon', action='store_true', help='Run in the background, keeping the MPD connection and '
+                                                           'library warm for later invocations')
+
+parser.add_argument('--record', metavar='FILE', help='Record the MPD protocol exchange and menu choices of this '
+                                                     'session to a file, for replaying with benchmarks.replay')
+
+parser.add_argument('--profile', metavar='FILE', nargs='?', const='-',
+                    help='Report time and memory spent in each phase as JSON, to stderr or a file. '
+                         'Time spent in rofi is reported separately')
+
+parser.add_argument('--stats', action='store_true', help='Show latency percentiles of recorded runs per mode and host, '
+                                                          'then exit')
+
 parser.add_argument('-r', '--args', nargs=argparse.REMAINDER, help='Command line arguments for rofi. '
                                                                    'Separate each argument with a space.')
 
-args = parser.parse_args()
+# Parsed by run(), rather than on import
+args = None
+
 
+def select(data, prompt, rofi, select=None, multi_select=False, shown=None):
+    """Shows a menu and returns the index picked, exiting if it was cancelled.
+    If given, shown is called once every row has been handed to rofi."""
+    if shown is not None:
+        data = then(data, shown)
 
-def select(data, prompt, rofi, select=None):
-    index, key = rofi.select(prompt, data, select=select)
+    if not isinstance(data, list):
+        data = profiler.iterate('menu', data)
+
+    with profiler.phase('rofi'):
+        index, key = rofi.select(prompt, data, select=select, multi_select=multi_select)
 
     if key == -1:
         sys.exit()
@@ -45,76 +81,153 @@ def select(data, prompt, rofi, select=None):
     return index
 
 
-def select_host(hosts, rofi: Rofi):
-    index = select([host['host'] for host in hosts], 'Select host', rofi)
+def select_repeatedly(data, prompt, rofi: Rofi, cycle=True, persistent=False, multi_select=False):
+    """Yields a list of the indices picked in each selection,
+    re-opening the menu after each one if cycle is set.
+
+    If data is an iterator rather than a list, the first menu is streamed
+    into rofi as rows are produced, and the rows are kept for later cycles.
+    If it is a function returning such an iterator instead, it is called
+    for every cycle, so the rows never have to be held all at once.
+
+    In persistent mode a single rofi process stays open across selections,
+    but only one option can be picked at a time."""
+    if cycle and persistent and not multi_select:
+        if callable(data):
+            data = data()
+
+        if not isinstance(data, list):
+            data = profiler.iterate('menu', data)
+
+        for index in profiler.iterate('rofi', rofi.select_persistent(prompt, data, select=0)):
+            yield [index]
+        sys.exit()
+
+    rows = data if isinstance(data, list) else []
+    if callable(data):
+        options = data()
+    else:
+        options = data if isinstance(data, list) else remember(data, rows)
+
+    prev_index = -1
+    first_cycle = True
+    while cycle or first_cycle:
+        if multi_select:
+            indices = select(options, prompt, rofi, select=prev_index + 1, multi_select=True)
+        else:
+            indices = [select(options, prompt, rofi, select=prev_index + 1)]
+
+        # The rows are only needed again if the menu re-opens
+        if cycle:
+            if callable(data):
+                options = data()
+            elif options is not rows:
+                # Rofi may have exited before reading every row
+                with profiler.phase('menu'):
+                    rows.extend(data)
+                options = rows
+
+        prev_index = indices[-1]
+        first_cycle = False
+
+        yield indices
+
+
+def remember(rows, seen):
+    """Yields each row, keeping a copy in seen."""
+    for row in rows:
+        seen.append(row)
+        yield row
+
+
+def then(rows, callback):
+    """Yields each row, then calls callback."""
+    yield from rows
+    callback()
+
+
+def select_host(hosts, rofi: Rofi, rows=None):
+    if rows is None:
+        rows = [host['host'] for host in hosts]
+
+    index = select(rows, 'Select host', rofi)
     return hosts[index]
 
 
-def select_artist(artists, rofi: Rofi):
-    index = select(artists, 'Select artist', rofi)
+def select_artist(artists, rofi: Rofi, shown=None):
+    index = select(artists, 'Select artist', rofi, shown=shown)
     return artists[index]
 
 
-def select_album(albums, rofi: Rofi):
-    index = select(
-        ['[%s] %s' % (get_epoch_as_year(int(get_tag('date', album))), get_tag('album', album)) for album in albums],
-        'Select album', rofi)
+def select_album(albums, rofi: Rofi, shown=None, album_hosts=None):
+    with profiler.phase('menu'):
+        display_albums = ['[%s] %s' % (get_epoch_as_year(int(get_tag('date', album))), get_tag('album', album))
+                          for album in albums]
+
+        if album_hosts:
+            display_albums = ['%s  (%s)' % (row, ', '.join(album_hosts[album['album']]))
+                              for row, album in zip(display_albums, albums)]
+
+    index = select(display_albums, 'Select album', rofi, shown=shown)
 
     return albums[index]['album']
 
 
-def select_genre(genres, rofi: Rofi):
-    index = select(genres, 'Select genre', rofi)
+def select_genre(genres, rofi: Rofi, shown=None):
+    index = select(genres, 'Select genre', rofi, shown=shown)
 
     return genres[index]
 
 
-def select_track(tracks, rofi: Rofi, discs=False, cycle=True):
+def select_track(tracks, rofi: Rofi, discs=False, cycle=True, persistent=False, multi_select=False):
     extras = ['All']
     if discs:
         disc_numbers = set([get_tag('disc', track) for track in tracks])
         if len(disc_numbers) > 1:
             extras.append('Disc...')
 
-    display_tracks = extras + [
-        '[%s.%s]  \t%s [%s - %s]' % (
-            get_tag('disc', track),
-            get_tag('track', track),
-            get_tag('title', track),
-            get_tag('album', track),
-            get_tag('artist', track))
-        for track in tracks]
+    # Formatted lazily so the menu can open before every row exists
+    def display_tracks():
+        return itertools.chain(extras, (
+            '[%s.%s]  \t%s [%s - %s]' % (
+                get_tag('disc', track),
+                get_tag('track', track),
+                get_tag('title', track),
+                get_tag('album', track),
+                get_tag('artist', track))
+            for track in tracks))
 
-    prev_index = -1
-    first_cycle = True
-    while cycle or first_cycle:
-        index = select(display_tracks, 'Select track', rofi, select=prev_index + 1)
+    # Windowed tracks are streamed from the server again for each cycle, rather than keeping every row
+    data = display_tracks if isinstance(tracks, TrackWindows) else display_tracks()
 
-        prev_index = index
-        first_cycle = False
-
-        yield (extras + tracks)[index]
+    for indices in select_repeatedly(data, 'Select track', rofi, cycle, persistent, multi_select):
+        yield [extras[index] if index < len(extras) else tracks[index - len(extras)] for index in indices]
 
 
-def select_disc(tracks, rofi: Rofi, music_library, cycle=True, enable_disc_names=True):
-    discs = {}
+def select_disc(tracks, rofi: Rofi, music_library, cycle=True, enable_disc_names=True, persistent=False,
+                multi_select=False, disc_name_cache=None, workers=1, timeout=None, client=None, source='file'):
+    first_tracks = {}
     for track in tracks:
         disc_num = get_tag('disc', track)
-        if disc_num not in discs:
-            discs[disc_num] = (get_disc_name(track, music_library, enable_disc_names))
+        if disc_num not in first_tracks:
+            first_tracks[disc_num] = track
 
-    display_discs = [{'num': num, 'name': name} for (num, name) in discs.items()]
-    display_discs.sort(key=lambda x: int(x['num']))
+    with profiler.phase('disc_names'):
+        discs = get_disc_names(first_tracks, music_library, enable_disc_names, disc_name_cache, workers, timeout,
+                               client, source)
 
-    prev_index = -1
-    first_cycle = True
-    while cycle or first_cycle:
-        index = select([disc['name'] for disc in display_discs], 'Select disc', rofi, select=prev_index + 1)
+    if disc_name_cache:
+        try:
+            disc_name_cache.save()
+        except OSError:
+            pass
 
-        prev_index = index
-        first_cycle = False
+    display_discs = [{'num': num, 'name': name} for (num, name) in discs.items()]
+    display_discs.sort(key=lambda x: int(x['num']))
 
-        yield display_discs[index]['num']
+    for indices in select_repeatedly([disc['name'] for disc in display_discs], 'Select disc', rofi, cycle,
+                                     persistent, multi_select):
+        yield [display_discs[index]['num'] for index in indices]
 
 
 def select_playlist(playlists, rofi: Rofi):
@@ -125,10 +238,11 @@ def select_playlist(playlists, rofi: Rofi):
 
 
 def get_album_date(client, album, artist=None):
-    if artist:
-        tracks = client.find('artist', artist, 'album', album)
-    else:
-        tracks = client.find('album', album)
+    with profiler.phase('query'):
+        if artist:
+            tracks = client.find('artist', artist, 'album', album)
+        else:
+            tracks = client.find('album', album)
     if len(tracks) > 0:
         for track in tracks:
             if 'date' in track:
@@ -137,7 +251,52 @@ def get_album_date(client, album, artist=None):
     return LONG_TIME_AGO
 
 
+def get_album_dates(client, albums, artist=None):
+    """Returns a dict mapping each album to its date, resolved in a single grouped `list` request.
+
+    Falls back to fetching tracks on servers which do not support grouping."""
+    filters = ('artist', artist) if artist else ()
+
+    try:
+        with profiler.phase('query'):
+            rows = client.list('date', *filters, 'group', 'album')
+    except CommandError:
+        rows = None
+
+    if rows is None or (rows and not isinstance(rows[0], dict)):
+        return get_album_dates_fallback(client, albums, artist)
+
+    dates = dict.fromkeys(albums, LONG_TIME_AGO)
+    rows = [row for row in rows if row.get('album') in dates and row.get('date')]
+
+    for row, epoch in zip(rows, get_epochs_from_dates([row['date'] for row in rows])):
+        album = row['album']
+
+        # An album spanning several dates is placed at the earliest
+        if dates[album] == LONG_TIME_AGO or epoch < dates[album]:
+            dates[album] = epoch
+
+    return dates
+
+
+def get_album_dates_fallback(client, albums, artist=None):
+    if artist:
+        return Library(read_tracks(client, 'find', 'artist', artist)).album_dates(albums, artist)
+
+    return {album: get_album_date(client, album) for album in albums}
+
+
+def list_tag(client, tag, *filters):
+    """Wrapper around `client.list()` which returns plain strings
+    regardless of whether python-mpd2 returns strings or dicts."""
+    with profiler.phase('query'):
+        return [value[tag] if isinstance(value, dict) else value for value in client.list(tag, *filters)]
+
+
 def get_tag(tag: str, track):
+    if isinstance(track, Track):
+        return track.get_tag(tag)
+
     if tag == 'track' or tag == 'disc':
         func = int
         default = 1
@@ -156,117 +315,570 @@ def get_tag(tag: str, track):
         return default
 
 
-def get_disc_name(track, music_library, enable_disc_names=True):
-    name = 'Disc %s' % track.get('disc') or 1
+def get_disc_names(first_tracks, music_library, enable_disc_names=True, disc_name_cache=None, workers=1,
+                   timeout=None, client=None, source='file'):
+    """Returns a dict mapping each disc number to its name, given the first track of each disc.
+
+    With the 'mpd' or 'auto' source, subtitles are first read by MPD with
+    `readcomments`. With 'file', or 'auto' for discs MPD found no subtitle
+    for, files are read from the music directory concurrently by up to
+    `workers` threads. Any still unread after `timeout` seconds are shown as
+    plain "Disc N" names instead."""
+    names = {num: 'Disc %s' % num for num in first_tracks}
+    if not enable_disc_names or not first_tracks:
+        return names
+
+    unread = dict(first_tracks)
+
+    if source in ('mpd', 'auto') and client is not None:
+        subtitles = read_disc_subtitles_from_mpd(client, [get_tag('file', track) for track in unread.values()])
+        for num, track in list(unread.items()):
+            subtitle = subtitles.get(get_tag('file', track))
+            if subtitle:
+                names[num] += subtitle
+                del unread[num]
+
+    if source == 'mpd' or (source == 'auto' and not os.path.isdir(music_library)):
+        return names
+
+    pending = Queue()
+    for item in unread.items():
+        pending.put(item)
+
+    lock = threading.Lock()
+    resolved = {}
+
+    def work():
+        while True:
+            try:
+                num, track = pending.get_nowait()
+            except Empty:
+                return
+
+            try:
+                name = get_disc_name(track, music_library, enable_disc_names, disc_name_cache)
+            except OSError:
+                continue
+
+            with lock:
+                resolved[num] = name
+
+    # Daemon threads, so a read stuck on a dead network mount can't hold up exiting
+    threads = [threading.Thread(target=work, daemon=True) for _ in range(min(workers, len(unread)))]
+    for thread in threads:
+        thread.start()
+
+    deadline = time.monotonic() + timeout if timeout else None
+    for thread in threads:
+        thread.join(max(0, deadline - time.monotonic()) if deadline else None)
+
+    with lock:
+        names.update(resolved)
+
+    return names
+
+
+def get_disc_name(track, music_library, enable_disc_names=True, disc_name_cache=None):
+    name = 'Disc %s' % get_tag('disc', track)
 
     if enable_disc_names:
-        tags = mutagen.File(os.path.join(music_library, get_tag('file', track)))
-        if 'TSST' in tags:
-            name += ': ' + tags['TSST'][0]
-        if 'TXXX:TSST' in tags:
-            name += ': ' + tags['TXXX:TSST'][0]
+        path = os.path.join(music_library, get_tag('file', track))
+        if disc_name_cache:
+            name += disc_name_cache.get_subtitle(path)
+        else:
+            name += read_disc_subtitle(path)
 
     return name
 
 
-def get_album(client, rofi, albums, artist=None):
-    dated_albums = [{'album': album, 'date': get_album_date(client, album, artist)} for album in albums]
-    dated_albums.sort(key=lambda x: x['date'])
-    return select_album(dated_albums, rofi)
+def get_album(client, rofi, albums, artist=None, library=None, dates=None, shown=None, album_hosts=None):
+    with profiler.phase('dates'):
+        if dates is None:
+            dates = library.album_dates(albums, artist) if library else get_album_dates(client, albums, artist)
+
+        dated_albums = [{'album': album, 'date': dates[album]} for album in albums]
+        dated_albums.sort(key=lambda x: x['date'])
+    return select_album(dated_albums, rofi, shown, album_hosts)
 
 
-def get_tracks(client, rofi):
+def get_tracks(client, rofi, library=None, prefetcher=None, window_size=None, max_resident=None):
+    """Shows the menus for the current mode and returns the chosen tracks,
+    along with the tag filters they were found with (or None if there are none).
+
+    With a window size, all tracks (-t) are fetched from the server a window at a time
+    as the menu reads them, keeping at most max_resident in memory.
+
+    With a prefetcher, what the next menu needs is fetched in the background
+    while the current one is open, and used if it has arrived by the time it's needed."""
+    filters = None
+    album_index = None
+    matching = None
+    shown = prefetcher.release if prefetcher else None
+
     if args.playlists:
-        tracks = client.listplaylists()
+        with profiler.phase('query'):
+            tracks = client.listplaylists()
+    elif library:
+        tracks, filters = get_library_tracks(library, rofi)
     elif args.tracks:
-        tracks = client.find('(title != "")')
+        tracks = get_all_tracks(client, window_size, max_resident)
     elif args.albums:
-        albums = client.list('album')
+        albums = list_tag(client, 'album')
         album = get_album(client, rofi, albums)
 
-        tracks = client.find('album', album)
+        filters = dict(album=album)
+
+    elif args.genres:
+        if prefetcher:
+            album_index = prefetcher.submit(fetch_album_index, 'genre', False)
+
+        genres = list_tag(client, 'genre')
+        genre = select_genre(genres, rofi, shown)
+
+        if prefetcher:
+            prefetcher.hold()
+            matching = prefetcher.submit(read_tracks, 'find', get_filter_expression(dict(genre=genre)))
+
+        albums, dates = get_prefetched_albums(prefetcher, album_index, genre)
+        if albums is None:
+            albums = list_tag(client, 'album', get_filter_expression(dict(genre=genre)))
+        album = get_album(client, rofi, albums, dates=dates, shown=shown)
+
+        filters = dict(genre=genre, album=album)
+
+    else:
+        if prefetcher:
+            album_index = prefetcher.submit(fetch_album_index, 'artist')
+
+        artists = list_tag(client, 'artist')
+        artist = select_artist(artists, rofi, shown)
+
+        if prefetcher:
+            prefetcher.hold()
+            matching = prefetcher.submit(read_tracks, 'find', get_filter_expression(dict(artist=artist)))
+
+        albums, dates = get_prefetched_albums(prefetcher, album_index, artist)
+        if albums is None:
+            albums = list_tag(client, 'album', get_filter_expression(dict(artist=artist)))
+        album = get_album(client, rofi, albums, artist, dates=dates, shown=shown)
+
+        filters = dict(artist=artist, album=album)
+
+    if filters is not None and not library:
+        found = prefetcher.result(matching) if matching else None
+
+        if found is not None:
+            tracks = [track for track in found if matches(track, filters)]
+        else:
+            tracks = read_tracks(client, 'find', get_filter_expression(filters))
+
+    # Windows come sorted by the server
+    if not isinstance(tracks, TrackWindows):
+        with profiler.phase('sort'):
+            sort_tracks(tracks)
+
+    return tracks, filters
+
+
+def get_all_tracks(client, window_size=None, max_resident=None):
+    """Returns every track with a title, in windows if a window size is given.
+
+    The server can only sort by one tag, so windowed tracks are ordered by artist,
+    and then as they are stored in the database, rather than exactly as `sort_tracks()` would."""
+    if window_size:
+        tracks = TrackWindows(client, '(title != "")', 'artist', window_size, max_resident or window_size)
+
+        try:
+            # Fetched now so servers without sort and window (before MPD 0.21) are found out before the menu opens
+            tracks.get_window(0)
+            return tracks
+        except CommandError:
+            pass
+
+    return read_tracks(client, 'find', '(title != "")')
+
+
+def fetch_album_index(client, group, group_dates=True):
+    """Fetches every album and its date in two requests, grouped by another tag (such as artist).
+
+    Returns a dict mapping each value of the group tag to a dict of its albums and their dates.
+    Dates are the earliest of the album's tracks within the group, or anywhere
+    if group_dates is False, matching what `get_album_dates()` would return."""
+    index = {}
+    for row in client.list('album', 'group', group):
+        if 'album' in row:
+            index.setdefault(row.get(group, ''), {})[row['album']] = LONG_TIME_AGO
+
+    groups = ('group', 'album', 'group', group) if group_dates else ('group', 'album')
+    rows = [row for row in client.list('date', *groups) if row.get('album') and row.get('date')]
+
+    dates = {}
+    for row, epoch in zip(rows, get_epochs_from_dates([row['date'] for row in rows])):
+        key = (row.get(group, ''), row['album']) if group_dates else row['album']
+
+        # An album spanning several dates is placed at the earliest
+        if key not in dates or epoch < dates[key]:
+            dates[key] = epoch
+
+    for value, albums in index.items():
+        for album in albums:
+            albums[album] = dates.get((value, album) if group_dates else album, LONG_TIME_AGO)
+
+    return index
+
+
+def get_prefetched_albums(prefetcher, album_index, key):
+    """Returns the albums under one key of a prefetched album index, along with their dates,
+    or (None, None) if the index hasn't arrived."""
+    index = prefetcher.result(album_index) if album_index else None
+    if index is None or key not in index:
+        return None, None
+
+    return list(index[key]), index[key]
+
+
+def get_library_tracks(library, rofi):
+    """Same as the server branches of `get_tracks()`, but answered from a library snapshot."""
+    if args.tracks:
+        return [track for track in library.tracks if track.get('title')], None
+    elif args.albums:
+        albums = library.list('album')
+        album = get_album(None, rofi, albums, library=library, album_hosts=get_album_hosts(library, albums))
+
+        filters = dict(album=album)
 
     elif args.genres:
-        genres = client.list('genre')
+        genres = library.list('genre')
         genre = select_genre(genres, rofi)
 
-        albums = client.list('album', '(genre == "%s")' % genre)
-        album = get_album(client, rofi, albums)
+        albums = library.list('album', genre=genre)
+        album = get_album(None, rofi, albums, library=library,
+                          album_hosts=get_album_hosts(library, albums, genre=genre))
 
-        tracks = client.find('genre', genre, 'album', album)
+        filters = dict(genre=genre, album=album)
 
     else:
-        artists = client.list('artist')
+        artists = library.list('artist')
         artist = select_artist(artists, rofi)
 
-        albums = client.list('album', '(artist == "%s")' % artist)
-        album = get_album(client, rofi, albums, artist)
+        albums = library.list('album', artist=artist)
+        album = get_album(None, rofi, albums, artist, library=library,
+                          album_hosts=get_album_hosts(library, albums, artist=artist))
 
-        tracks = client.find('artist', artist, 'album', album)
+        filters = dict(artist=artist, album=album)
 
-    tracks.sort(key=lambda t: (
-        get_tag('artist', t),
-        get_tag('album', t),
-        get_tag('disc', t),
-        get_tag('track', t)
-    ))
+    return library.find(**filters), filters
 
-    return tracks
 
+def get_album_hosts(library, albums, **filters):
+    """Returns which hosts have each album, if the library spans several hosts."""
+    if not library.federated or len(library.hosts) < 2:
+        return None
 
-def run():
-    config = load_config()
+    with profiler.phase('menu'):
+        return library.album_hosts(albums, **filters)
 
-    music_directory = os.path.expanduser(args.music_directory or config['music_directory'])
-    single_host_mode = args.host is not None or len(config['hosts']) == 1
-    case_sensitive = args.case_sensitive or config['case_sensitive']
 
-    cycle_tracks = config['tracks_keep_open']
-    cycle_discs = config['discs_keep_open']
+def select_federated_host(library, tracks, rofi: Rofi, preferred=None):
+    """Picks which host of a federated library to queue the tracks on, asking if more than one has them.
+    The preferred host is kept without asking if it has every track.
+
+    Returns the index of the host."""
+    found = library.get_hosts(tracks)
+
+    # Hosts with every track are the only choices, unless none of them do
+    complete = [(index, count) for index, count in found if count == len(tracks)]
+    if complete:
+        if preferred in [index for index, _ in complete]:
+            return preferred
+        found = complete
+
+    if len(found) == 1:
+        return found[0][0]
+
+    rows = ['%s  (%d/%d tracks)' % (library.hosts[index]['host'], count, len(tracks)) for index, count in found]
+    return found[select(rows, 'Select host', rofi)][0]
+
+
+def queue_federated(library, rofi: Rofi, selection, filters, play_on_add, preferred=None):
+    """Same as `queue_tracks()`, but for tracks from a federated library, which are queued
+    on a host with a copy of them. Only that host's own copies are added.
+
+    Returns the index of the host, to be preferred for the next selection."""
+    tracks = [track for item in selection for track in (item if isinstance(item, list) else [item])]
+    index = select_federated_host(library, tracks, rofi, preferred)
+
+    copies = []
+    for item in selection:
+        if isinstance(item, list):
+            copies.append(library.get_copies(item, index))
+        else:
+            copies.extend(library.get_copies([item], index))
+
+    queue_tracks(CommandBatch(library.clients[index]), [item for item in copies if item], filters, play_on_add)
+    return index
+
+
+def get_raw_tag(tag, track):
+    """Returns the tag exactly as MPD stores it, or an empty string
+    (which MPD filters treat as 'tag not present') if it is missing."""
+    value = track.get(tag, '')
+    if type(value) == list:
+        return value[0]
+    return value
+
+
+def add_matching(batch: CommandBatch, tracks, filters):
+    """Queues server-side `findadd` commands covering exactly `tracks`,
+    which must all match `filters`.
+
+    One command is issued per disc (and per artist, if there are several)
+    so the queue keeps the artist/disc/track order of the track menu.
+    Returns False if the tracks can not be split up that way."""
+    artists = set(get_tag('artist', track) for track in tracks)
+    split_artists = len(artists) > 1 and 'artist' not in filters
+
+    # A track with several artists would match more than one artist group
+    if split_artists and any(type(track.get('artist')) == list for track in tracks):
+        return False
+
+    groups = []
+    for track in tracks:
+        group = dict(filters)
+        if split_artists:
+            group['artist'] = get_raw_tag('artist', track)
+        group['disc'] = get_raw_tag('disc', track)
+
+        if group not in groups:
+            groups.append(group)
+
+    for group in groups:
+        batch.add('findadd', get_filter_expression(group), 'sort', 'track')
+
+    return True
+
+
+def queue_tracks(batch: CommandBatch, selection, filters, play_on_add, use_findadd=True):
+    """Adds a selection to the queue in one round trip.
+
+    Each item in the selection is either a single track, or a list of tracks
+    matching `filters` which is added with server-side `findadd` where possible.
+    Lists must come first, so a failing `findadd` is always the first command."""
+    for item in selection:
+        if not isinstance(item, (list, TrackWindows)):
+            batch.add('add', get_tag('file', item))
+        elif not (use_findadd and filters is not None and add_matching(batch, item, filters)):
+            for track in item:
+                batch.add('add', get_tag('file', track))
+
+    try:
+        queue(batch, play_on_add)
+    except CommandBatchError as e:
+        # Older servers reject sort on findadd. MPD aborts a command list at the
+        # first failure, so if that was the first command nothing has been added yet.
+        if not use_findadd or e.failed_command != 'findadd' or e.offset:
+            raise
+
+        queue_tracks(batch, selection, filters, play_on_add, use_findadd=False)
+
+
+def queue(batch: CommandBatch, play_on_add):
+    """Sends a batch of queue mutations, starting playback in the same round trip if required.
+
+    `play` without a position leaves MPD playing if it already is,
+    so no `status` check is needed beforehand."""
+    if play_on_add:
+        batch.add('play')
+
+    with profiler.phase('queue'):
+        batch.send()
+
+
+def get_rofi(config, recorder=None):
+    case_sensitive = args.case_sensitive or config['case_sensitive']
 
     rofi_args = args.args or []
     if not case_sensitive:
         rofi_args.append('-i')
 
-    rofi = Rofi(rofi_args=rofi_args)
+    if recorder:
+        return RecordingRofi(recorder, rofi_args=rofi_args)
+
+    return Rofi(rofi_args=rofi_args)
+
+
+def get_host(config, rofi: Rofi, probe=False):
+    """Returns the host to use, along with an open connection to it if one was made while probing."""
+    single_host_mode = args.host is not None or len(config['hosts']) == 1
 
     if single_host_mode:
         if args.host:
-            host = dict(host=args.host, port=args.port or 6600)
+            return dict(host=args.host, port=args.port or 6600), None
         else:
-            host = config['hosts'][0]
-    else:
-        host = select_host(config['hosts'], rofi)
+            return config['hosts'][0], None
+    elif not probe:
+        return select_host(config['hosts'], rofi), None
+
+    return probe_and_select_host(config['hosts'], rofi, config['probe_timeout'])
+
+
+def probe_and_select_host(hosts, rofi: Rofi, timeout):
+    """Probes every host at once, annotating the host menu with whether each one answered,
+    how quickly, and what it is playing.
+
+    Returns the chosen host and the connection made while probing it, if it answered."""
+    from .probe import close_probes, get_probe, probe_hosts
+
+    futures = probe_hosts(hosts, timeout)
 
+    # Connecting and asking for the status may each take up to the timeout
+    deadline = time.monotonic() + 2 * timeout
+
+    with profiler.phase('connect'):
+        probes = [get_probe(future, host, deadline) for future, host in zip(futures, hosts)]
+
+    client = None
+    try:
+        host = select_host(hosts, rofi, [probe.describe() for probe in probes])
+        client = probes[hosts.index(host)].client
+    finally:
+        close_probes(futures, keep=client)
+
+    return host, client
+
+
+def connect(host, recorder=None, timeout=None):
+    """Connects to the host, giving up after timeout seconds if given.
+    The timeout only applies to connecting, not to later requests."""
     client = MPDClient()
+    client.timeout = timeout
     client.connect(host['host'], host['port'])
+    client.timeout = None
 
-    tracks = get_tracks(client, rofi)
+    if recorder:
+        recorder.attach(client)
 
-    if args.playlists:
-        playlist = select_playlist(tracks, rofi)
-        client.load(playlist['playlist'])
-    else:
-        for track in select_track(tracks, rofi,
-                                  discs=not (args.tracks or args.genres),
-                                  cycle=cycle_tracks):
-            if track == 'All':
-                for track in tracks:
-                    client.add(get_tag('file', track))
+    return client
 
-            elif track == 'Disc...':
-                for disc in select_disc(tracks, rofi, music_directory, cycle=cycle_discs,
-                                        enable_disc_names=config['enable_disc_names']):
-                    disc_tracks = [track for track in tracks if get_tag('disc', track) == disc]
 
-                    for track in disc_tracks:
-                        client.add(get_tag('file', track))
+def run(argv=None):
+    global args
+    args = parser.parse_args(argv)
 
-                if not cycle_discs:
-                    break
+    if args.profile:
+        profiler.start()
 
-            else:
-                client.add(get_tag('file', track))
+    with profiler.phase('config'):
+        config = load_config()
+
+    if args.daemon:
+        from .daemon import serve
+        return serve(config)
+
+    if args.stats:
+        return print_stats(config)
+
+    if config['metrics_enabled'] and not args.profile:
+        profiler.start(trace_memory=False)
+
+    recorder = None
+    if args.record:
+        recorder = Recorder(args.record, sys.argv[1:] if argv is None else argv,
+                            dict(track_window_size=config['track_window_size'],
+                                 max_resident_tracks=config['max_resident_tracks']))
+
+        # Make sure every query goes to the server so the recording can answer it
+        config['cache_enabled'] = False
+
+    host = None
+    prefetcher = None
+    deferred = False
+    try:
+        rofi = get_rofi(config, recorder)
+
+        # Playlists belong to a single host, and a recording can only hold one connection
+        if args.federated and not (args.playlists or recorder):
+            from .federation import load_federated_library
+
+            with profiler.phase('library'):
+                library = load_federated_library(config['hosts'], config)
+
+            if library is None:
+                raise ConnectionError('None of the configured hosts could be reached')
+
+            return browse(None, rofi, config, library)
+
+        # Probing connects outside of the recording, so the recording couldn't be replayed
+        host, client = get_host(config, rofi, probe=config['probe_hosts'] and recorder is None)
+        timeout = config['connect_timeout'] or None
+
+        # The list of all tracks is always fetched in windows, so it never holds more than max_resident_tracks
+        use_library = config['cache_enabled'] and not (args.playlists or args.tracks)
+
+        library = None
+        if client is None and config['deferred_connect'] and use_library:
+            with profiler.phase('library'):
+                library = get_snapshot_library(host)
+
+        if library is not None:
+            from .deferred import DeferredClient
+            client = DeferredClient(lambda remaining: connect(host, timeout=remaining), timeout)
+            deferred = True
+        else:
+            if client is None:
+                with profiler.phase('connect'):
+                    client = connect(host, recorder, timeout)
+
+            if use_library:
+                with profiler.phase('library'):
+                    library = get_library(client, host, config)
+
+        # Prefetching queries on its own connection, which the recording wouldn't hold
+        if (config['prefetch'] and library is None and recorder is None
+                and not (args.playlists or args.tracks or args.albums)):
+            from .prefetch import Prefetcher
+            prefetcher = Prefetcher(host)
+
+        browse(client, rofi, config, library, prefetcher)
+    finally:
+        if prefetcher:
+            prefetcher.cancel()
+
+        if recorder:
+            recorder.close()
+
+        if args.profile:
+            profiler.write(args.profile)
+
+        if config['metrics_enabled'] and host is not None:
+            record_run(config, profiler.report(), get_mode(args), host)
+
+        if deferred:
+            # The snapshot was used without checking it, so bring it up to date for next time
+            try:
+                get_library(client, host, config)
+            except (MPDError, OSError):
+                pass
+
+
+def browse(client, rofi: Rofi, config, library=None, prefetcher=None):
+    """Shows the menus for the current mode and queues whatever is selected."""
+    music_directory = os.path.expanduser(args.music_directory or config['music_directory'])
+
+    cycle_tracks = config['tracks_keep_open']
+    cycle_discs = config['discs_keep_open']
+
+    tracks, filters = get_tracks(client, rofi, library, prefetcher,
+                                 config['track_window_size'], config['max_resident_tracks'])
+
+    # Anything still being fetched is no longer needed
+    if prefetcher:
+        prefetcher.cancel()
+
+    federated = library is not None and library.federated
+    if federated and tracks:
+        # Disc names are read through the host the first track's listed copy came from
+        client = library.get_client(tracks[0])
 
     play_on_add = None
     if 'play_on_add' in config:
@@ -275,6 +887,56 @@ def run():
     if args.play_on_add is not None:
         play_on_add = args.play_on_add
 
-    if play_on_add:
-        if client.status()['state'] != 'play':
-            client.play()
+    batch = CommandBatch(client)
+
+    # Each selection from a federated library is queued on a host which has it
+    host_index = None
+
+    def add(selection):
+        nonlocal host_index
+        if federated:
+            host_index = queue_federated(library, rofi, selection, filters, play_on_add, host_index)
+        else:
+            queue_tracks(batch, selection, filters, play_on_add)
+
+    if args.playlists:
+        playlist = select_playlist(tracks, rofi)
+        batch.add('load', playlist['playlist'])
+        queue(batch, play_on_add)
+    else:
+        for selection in select_track(tracks, rofi,
+                                      discs=not (args.tracks or args.genres),
+                                      cycle=cycle_tracks,
+                                      persistent=config['persistent_menus'],
+                                      multi_select=config['multi_select']):
+            if 'All' in selection:
+                add([tracks])
+            else:
+                items = [track for track in selection if track != 'Disc...']
+                if items:
+                    add(items)
+
+            if 'Disc...' in selection:
+                disc_tracks = {}
+                for track in tracks:
+                    disc_tracks.setdefault(get_tag('disc', track), []).append(track)
+
+                # Only names read from the files themselves are cached
+                disc_name_cache = None
+                if (config['enable_disc_names'] and config['disc_name_cache_size']
+                        and config['disc_name_source'] in ('file', 'auto')):
+                    disc_name_cache = DiscNameCache(config['disc_name_cache_size'])
+
+                for discs in select_disc(tracks, rofi, music_directory, cycle=cycle_discs,
+                                         enable_disc_names=config['enable_disc_names'],
+                                         persistent=config['persistent_menus'],
+                                         multi_select=config['multi_select'],
+                                         disc_name_cache=disc_name_cache,
+                                         workers=config['disc_name_workers'],
+                                         timeout=config['disc_name_timeout'],
+                                         client=client,
+                                         source=config['disc_name_source']):
+                    add([disc_tracks[disc] for disc in discs])
+
+                if not cycle_discs:
+                    break
@@ -0,0 +1,23 @@
+import threading
+from concurrent.futures import Future
+
+
+def run_each(func, items):
+    """Calls func with every item at once, each on its own daemon thread,
+    so the wait is as long as the slowest call rather than all of them added up.
+
+    Returns a future per item, in the same order, holding what func returned or raised."""
+    futures = []
+    for item in items:
+        future = Future()
+        futures.append(future)
+
+        def work(item=item, future=future):
+            try:
+                future.set_result(func(item))
+            except Exception as e:
+                future.set_exception(e)
+
+        threading.Thread(target=work, daemon=True).start()
+
+    return futures